@@ -1,19 +1,26 @@
+from django.conf import settings
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
-from recipes.models import Recipe, Tag
-from rest_framework.filters import SearchFilter
+from recipes.autocomplete import get_ingredient_index
+from recipes.cache import INGREDIENT_CACHE, TAG_CACHE
+from recipes.models import Recipe, RecipeTag
+from rest_framework.filters import BaseFilterBackend
 
 
 class RecipeFilter(FilterSet):
     """Класс для фильтрации обьектов Recipes."""
 
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),)
+    # Варианты задаются в __init__ из кэша справочника.
+    tags = filters.MultipleChoiceFilter(method='tags_filter')
 
     is_favorited = filters.BooleanFilter(method='is_favorited_filter')
     is_in_shopping_cart = filters.BooleanFilter(
         method='is_in_shopping_cart_filter')
+    ordering = filters.ChoiceFilter(
+        choices=(
+            ('-pub_date', 'сначала новые'),
+            ('-favorites_count', 'сначала популярные'),),
+        method='ordering_filter',)
 
     class Meta:
         model = Recipe
@@ -21,7 +28,30 @@ class RecipeFilter(FilterSet):
             'tags',
             'author',
             'is_favorited',
-            'is_in_shopping_cart',)
+            'is_in_shopping_cart',
+            'ordering',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tag_ids = {}
+        if self.data.get('tags'):
+            self.tag_ids = {tag.slug: tag.pk for tag in TAG_CACHE.all()}
+        self.filters['tags'].extra['choices'] = [
+            (slug, slug) for slug in self.tag_ids]
+
+    def tags_filter(self, queryset, name, data):
+        if not data:
+            return queryset
+        return queryset.filter(Exists(RecipeTag.objects.filter(
+            recipe=OuterRef('pk'),
+            tag_id__in=[self.tag_ids[slug] for slug in data])))
+
+    def ordering_filter(self, queryset, name, data):
+        """Порядок рецептов; курсорная пагинация всегда идет по дате."""
+
+        if data == '-favorites_count':
+            return queryset.order_by('-favorites_count', '-pub_date', '-id')
+        return queryset.order_by('-pub_date', '-id')
 
     def is_favorited_filter(self, queryset, name, data):
         user = self.request.user
@@ -36,7 +66,16 @@ class RecipeFilter(FilterSet):
         return queryset
 
 
-class IngredientFilter(SearchFilter):
-    """Класс для фильтрации обьектов Tags."""
+class IngredientFilter(BaseFilterBackend):
+    """Поиск ингредиентов: сначала по началу названия, затем по вхождению."""
 
     search_param = 'name'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        ids = get_ingredient_index().search(
+            query, settings.INGREDIENT_SEARCH_LIMIT)
+        found = INGREDIENT_CACHE.get_many(ids)
+        return [found[pk] for pk in ids if pk in found]
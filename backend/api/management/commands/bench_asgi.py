@@ -0,0 +1,148 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from urllib.request import Request, urlopen
+
+from api.pooled_asgi import PooledHandlerMixin
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import AsyncClient, Client
+from django.test.client import AsyncClientHandler
+from recipes.models import Recipe
+from rest_framework.authtoken.models import Token
+from users.models import User
+
+from .bench_foodgram import percentile
+
+
+def summary(latencies, elapsed):
+    return (
+        f'{len(latencies) / elapsed:>9.1f}'
+        f'{percentile(latencies, 0.5) * 1000:>9.1f}'
+        f'{percentile(latencies, 0.99) * 1000:>9.1f}')
+
+
+class PooledClientHandler(PooledHandlerMixin, AsyncClientHandler):
+    """Обработчик тестового клиента с пулом, как у foodgram.asgi."""
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнение чтения через WSGI и ASGI: пропускная способность и "
+        "хвостовые задержки при одинаковом числе потоков")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='число запросов на сценарий')
+        parser.add_argument(
+            '--concurrency', type=int, default=32,
+            help='число одновременных клиентов')
+        parser.add_argument(
+            '--base-url', default=None,
+            help='нагружать запущенный сервер по HTTP, а не в процессе')
+
+    def get_scenarios(self):
+        user = User.objects.annotate(
+            follows=Count('follower')).order_by('-follows').first()
+        recipe = Recipe.objects.order_by('-pub_date').first()
+        if user is None or recipe is None:
+            raise CommandError(
+                'Нет данных: сначала выполните seed_foodgram')
+        token, _ = Token.objects.get_or_create(user=user)
+        return [
+            ('recipes', None, '/api/recipes/?limit=6'),
+            ('recipe_detail', token.key, f'/api/recipes/{recipe.pk}/'),
+            ('ingredients', None, '/api/ingredients/?name=мол'),
+            ('tags', None, '/api/tags/'),
+            ('subscriptions', token.key,
+             '/api/users/subscriptions/?limit=6&recipes_limit=3'),
+        ]
+
+    def run_threads(self, fetch, url, token, options):
+        """Запросы из пула потоков; возвращает задержки и общее время."""
+
+        def timed(_):
+            started = perf_counter()
+            fetch(url, token)
+            return perf_counter() - started
+
+        started = perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            latencies = list(executor.map(timed, range(options['requests'])))
+        return latencies, perf_counter() - started
+
+    def bench_wsgi(self, url, token, options):
+        # Под WSGI одновременно обрабатывается не больше запросов, чем
+        # потоков; их столько же, сколько потоков в пуле базы под ASGI.
+        workers = ThreadPoolExecutor(settings.ASYNC_DB_POOL_SIZE)
+        local = threading.local()
+
+        def request(url, token):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            client = local.client
+            headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+            response = client.get(url, **headers)
+            if response.status_code != 200:
+                raise CommandError(f'{url}: ответ {response.status_code}')
+
+        def fetch(url, token):
+            workers.submit(request, url, token).result()
+
+        try:
+            return self.run_threads(fetch, url, token, options)
+        finally:
+            workers.shutdown()
+
+    def bench_asgi(self, url, token, options):
+        client = AsyncClient()
+        client.handler = PooledClientHandler()
+        headers = {'authorization': f'Token {token}'} if token else {}
+
+        async def timed(semaphore):
+            async with semaphore:
+                started = perf_counter()
+                response = await client.get(url, **headers)
+                if response.status_code != 200:
+                    raise CommandError(f'{url}: ответ {response.status_code}')
+                return perf_counter() - started
+
+        async def run():
+            semaphore = asyncio.Semaphore(options['concurrency'])
+            started = perf_counter()
+            latencies = await asyncio.gather(*(
+                timed(semaphore) for _ in range(options['requests'])))
+            return latencies, perf_counter() - started
+
+        return asyncio.run(run())
+
+    def bench_http(self, url, token, options):
+        def fetch(url, token):
+            request = Request(options['base_url'].rstrip('/') + url)
+            if token:
+                request.add_header('Authorization', f'Token {token}')
+            with urlopen(request) as response:
+                response.read()
+
+        return self.run_threads(fetch, url, token, options)
+
+    def handle(self, *args, **options):
+        scenarios = self.get_scenarios()
+        if options['base_url']:
+            self.stdout.write(
+                f'{"сценарий":<16}{"запр/с":>9}{"p50 мс":>9}{"p99 мс":>9}')
+            for name, token, url in scenarios:
+                self.stdout.write(
+                    f'{name:<16}'
+                    + summary(*self.bench_http(url, token, options)))
+            return
+        columns = f'{"запр/с":>9}{"p50 мс":>9}{"p99 мс":>9}'
+        self.stdout.write(f'{"":<16}{"WSGI":>27}  {"ASGI":>27}')
+        self.stdout.write(f'{"сценарий":<16}{columns}  {columns}')
+        for name, token, url in scenarios:
+            wsgi = summary(*self.bench_wsgi(url, token, options))
+            asgi = summary(*self.bench_asgi(url, token, options))
+            self.stdout.write(f'{name:<16}{wsgi}  {asgi}')
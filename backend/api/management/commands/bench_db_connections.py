@@ -0,0 +1,116 @@
+import threading
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+
+from .bench_foodgram import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Смена подключений к базе при параллельных запросах: без "
+        "повторного использования, постоянные подключения и пул")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=400,
+            help='число запросов на режим')
+        parser.add_argument(
+            '--concurrency', type=int, default=16,
+            help='число потоков сервера')
+        parser.add_argument(
+            '--pool-size', type=int, default=None,
+            help='размер пула, по умолчанию половина потоков')
+        parser.add_argument('--url', default='/api/recipes/?limit=6')
+
+    def get_modes(self, options):
+        modes = [
+            ('без повтора', {'CONN_MAX_AGE': 0, 'POOL_MAX_SIZE': 0}),
+            ('постоянные', {'CONN_MAX_AGE': 600, 'POOL_MAX_SIZE': 0}),
+        ]
+        if hasattr(connections[DEFAULT_DB_ALIAS], 'connection_stats'):
+            pool_size = options['pool_size'] or max(
+                1, options['concurrency'] // 2)
+            modes.append((
+                f'пул {pool_size}',
+                {'CONN_MAX_AGE': 0, 'POOL_MAX_SIZE': pool_size}))
+        return modes
+
+    def run(self, options):
+        """Запросы из потоков сервера; задержки и время выполнения."""
+
+        requests = iter(range(options['requests']))
+        lock = threading.Lock()
+        latencies = []
+        errors = []
+
+        def worker():
+            client = Client()
+            try:
+                while True:
+                    with lock:
+                        if next(requests, None) is None:
+                            return
+                    started = perf_counter()
+                    # Тестовый клиент не закрывает подключения по сигналам
+                    # начала и конца запроса, как это делает сервер.
+                    close_old_connections()
+                    response = client.get(options['url'])
+                    close_old_connections()
+                    elapsed = perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                        if response.status_code != 200:
+                            errors.append(response.status_code)
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=worker)
+            for _ in range(options['concurrency'])]
+        started = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise CommandError(f'{options["url"]}: ответы {set(errors)}')
+        return latencies, perf_counter() - started
+
+    def handle(self, *args, **options):
+        settings_dict = connections.databases[DEFAULT_DB_ALIAS]
+        original = dict(settings_dict)
+        checkouts = []
+
+        def connection_opened(sender, connection, **kwargs):
+            checkouts.append(connection.alias)
+
+        def opened():
+            # Без счетчиков бекенда каждая выдача — новое подключение.
+            stats = getattr(
+                connections[DEFAULT_DB_ALIAS], 'connection_stats', None)
+            return stats().get('opened', 0) if stats else len(checkouts)
+
+        connection_created.connect(connection_opened)
+        self.stdout.write(
+            f'{"режим":<14}{"подключений":>12}{"выдач":>8}'
+            f'{"запр/с":>9}{"p50 мс":>9}{"p99 мс":>9}')
+        try:
+            for name, overrides in self.get_modes(options):
+                settings_dict.update(overrides)
+                checkouts.clear()
+                before = opened()
+                latencies, elapsed = self.run(options)
+                churn = opened() - before
+                self.stdout.write(
+                    f'{name:<14}{churn:>12}{len(checkouts):>8}'
+                    f'{len(latencies) / elapsed:>9.1f}'
+                    f'{percentile(latencies, 0.5) * 1000:>9.1f}'
+                    f'{percentile(latencies, 0.99) * 1000:>9.1f}')
+        finally:
+            connection_created.disconnect(connection_opened)
+            settings_dict.clear()
+            settings_dict.update(original)
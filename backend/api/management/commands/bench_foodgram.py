@@ -0,0 +1,144 @@
+import json
+from pathlib import Path
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from recipes.models import IngredientInRecipesAmount, Recipe, Tag
+from rest_framework.test import APIClient
+from users.models import User
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'bench_baseline.json'
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = "Нагрузочные замеры API: задержки и число запросов к базе"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='число запросов на сценарий')
+        parser.add_argument(
+            '--only', nargs='*', default=None,
+            help='выполнить только указанные сценарии')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='сохранить результаты как базовые')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='допустимый рост p90 относительно базового замера')
+
+    def get_scenarios(self):
+        """Сценарии: имя, пользователь и адрес запроса."""
+
+        user = User.objects.annotate(
+            follows=Count('follower')).order_by('-follows').first()
+        recipe = Recipe.objects.order_by('-pub_date').first()
+        if user is None or recipe is None:
+            raise CommandError(
+                'Нет данных: сначала выполните seed_foodgram')
+        slugs = list(Tag.objects.values_list('slug', flat=True)[:3])
+        ingredient_ids = list(IngredientInRecipesAmount.objects.filter(
+            recipe=recipe).values_list('ingredient_id', flat=True)[:3])
+        scenarios = [
+            ('recipes_anon', None, '/api/recipes/?limit=6'),
+            ('recipes_auth', user, '/api/recipes/?limit=6'),
+            ('recipes_deep_page', user, '/api/recipes/?limit=6&page=100'),
+            ('recipes_deep_page_no_count', user,
+             '/api/recipes/?limit=6&page=100&count=none'),
+            ('recipes_cursor', user,
+             '/api/recipes/?limit=6&pagination=cursor'),
+            ('recipes_favorited', user,
+             '/api/recipes/?limit=6&is_favorited=1'),
+            ('recipe_detail', user, f'/api/recipes/{recipe.pk}/'),
+            ('subscriptions', user,
+             '/api/users/subscriptions/?limit=6&recipes_limit=3'),
+            ('feed', user, '/api/users/feed/?limit=6'),
+            ('search_by_ingredients', None,
+             '/api/recipes/search_by_ingredients/?limit=6&ingredients='
+             + ','.join(map(str, ingredient_ids))),
+            ('users', user, '/api/users/?limit=6'),
+            ('tags', None, '/api/tags/'),
+            ('ingredients_search', None, '/api/ingredients/?name=мол'),
+            ('shopping_cart_download', user,
+             '/api/recipes/download_shopping_cart/'),
+        ]
+        for count in range(1, len(slugs) + 1):
+            scenarios.append((
+                f'recipes_tags_{count}', None,
+                '/api/recipes/?limit=6&'
+                + '&'.join(f'tags={slug}' for slug in slugs[:count])))
+        return scenarios
+
+    def measure(self, user, url, repeat):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        client.get(url)
+        timings = []
+        queries = 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as captured:
+                started = perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append((perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise CommandError(f'{url}: ответ {response.status_code}')
+            queries = max(queries, len(captured.captured_queries))
+        return {
+            'p50': percentile(timings, 0.5),
+            'p90': percentile(timings, 0.9),
+            'p99': percentile(timings, 0.99),
+            'queries': queries,
+        }
+
+    def handle(self, *args, **options):
+        results = {}
+        self.stdout.write(
+            f'{"сценарий":<30}{"p50 мс":>9}{"p90 мс":>9}{"p99 мс":>9}'
+            f'{"запросов":>10}')
+        for name, user, url in self.get_scenarios():
+            if options['only'] and name not in options['only']:
+                continue
+            result = results[name] = self.measure(
+                user, url, options['requests'])
+            self.stdout.write(
+                f'{name:<30}{result["p50"]:>9.2f}{result["p90"]:>9.2f}'
+                f'{result["p99"]:>9.2f}{result["queries"]:>10}')
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.write_text(json.dumps(results, indent=2))
+            self.stdout.write(f'Базовые замеры сохранены в {baseline_path}')
+            return
+        if not baseline_path.exists():
+            return
+        baseline = json.loads(baseline_path.read_text())
+        regressions = []
+        for name, result in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            if result['queries'] > base['queries']:
+                regressions.append(
+                    f'{name}: запросов {result["queries"]} '
+                    f'вместо {base["queries"]}')
+            if result['p90'] > base['p90'] * (1 + options['tolerance']):
+                regressions.append(
+                    f'{name}: p90 {result["p90"]:.2f} мс '
+                    f'вместо {base["p90"]:.2f} мс')
+        if regressions:
+            raise CommandError(
+                'Ухудшение относительно базовых замеров:\n'
+                + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
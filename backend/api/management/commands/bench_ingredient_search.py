@@ -0,0 +1,84 @@
+import random
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, OuterRef, Subquery
+from recipes.models import IngredientInRecipesAmount, Recipe
+from recipes.search import RECIPE_INGREDIENT_INDEX
+
+
+def sql_search(ingredient_ids, require_all=False, limit=100):
+    """Тот же поиск через JOIN и GROUP BY в базе."""
+
+    recipes = Recipe.objects.filter(
+        recipe__ingredient_id__in=ingredient_ids,
+    ).annotate(
+        matched=Count('recipe'),
+        total=Subquery(
+            IngredientInRecipesAmount.objects.filter(
+                recipe=OuterRef('pk'),
+            ).order_by().values('recipe').annotate(
+                total=Count('pk')).values('total')),
+    )
+    if require_all:
+        recipes = recipes.filter(matched=len(set(ingredient_ids)))
+    return list(recipes.order_by(
+        '-matched', (F('matched') - F('total')).desc(), '-id',
+    ).values_list('pk', flat=True)[:limit])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+class Command(BaseCommand):
+    help = "Сравнение поиска рецептов по ингредиентам: индекс и SQL"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queries', type=int, default=30,
+            help='число запросов каждого размера')
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1, 3, 5, 10],
+            help='число ингредиентов в запросе')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        popular = list(
+            IngredientInRecipesAmount.objects.values('ingredient_id')
+            .annotate(recipes=Count('recipe_id'))
+            .order_by('-recipes')
+            .values_list('ingredient_id', flat=True)[:200])
+        if not popular:
+            raise CommandError(
+                'Нет рецептов: сначала выполните seed_foodgram')
+        started = perf_counter()
+        RECIPE_INGREDIENT_INDEX.load()
+        self.stdout.write(
+            f'Построение индекса: {perf_counter() - started:.2f} с')
+        self.stdout.write(
+            f'{"ингредиентов":<14}{"все":<6}{"индекс мс":>11}'
+            f'{"SQL мс":>10}{"совпадает":>11}')
+        mismatches = 0
+        for size in options['sizes']:
+            for require_all in (False, True):
+                index_times, sql_times, equal = [], [], 0
+                for _ in range(options['queries']):
+                    ids = rng.sample(popular, min(size, len(popular)))
+                    started = perf_counter()
+                    found = RECIPE_INGREDIENT_INDEX.search(ids, require_all)
+                    index_times.append(perf_counter() - started)
+                    started = perf_counter()
+                    expected = sql_search(ids, require_all)
+                    sql_times.append(perf_counter() - started)
+                    equal += found == expected
+                mismatches += options['queries'] - equal
+                self.stdout.write(
+                    f'{size:<14}{"да" if require_all else "нет":<6}'
+                    f'{median(index_times) * 1000:>11.2f}'
+                    f'{median(sql_times) * 1000:>10.2f}'
+                    f'{equal:>7}/{options["queries"]}')
+        if mismatches:
+            raise CommandError(f'Результаты различаются: {mismatches}')
@@ -0,0 +1,79 @@
+from time import perf_counter
+
+from api.serializers import RecipesFastReadSerializer, RecipesReadSerializer
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from recipes.models import Recipe
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from users.models import User
+
+from .bench_ingredient_search import median
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнение сериализаторов чтения рецептов: совпадение JSON "
+        "и время на 100 рецептов")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=100,
+            help='число рецептов на странице')
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='число повторов каждого замера')
+
+    def get_users(self):
+        user = User.objects.annotate(
+            favorites=Count('favorite_user'),
+        ).order_by('-favorites').first()
+        if user is None:
+            raise CommandError(
+                'Нет данных: сначала выполните seed_foodgram')
+        return [('анонимный', AnonymousUser()), ('авторизованный', user)]
+
+    def render(self, serializer_class, recipes, request):
+        serializer = serializer_class(
+            recipes, many=True, context={'request': request})
+        return JSONRenderer().render(serializer.data)
+
+    def measure(self, serializer_class, recipes, request, repeat):
+        times = []
+        for _ in range(repeat):
+            started = perf_counter()
+            self.render(serializer_class, recipes, request)
+            times.append(perf_counter() - started)
+        return median(times) * 100 / len(recipes)
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        self.stdout.write(
+            f'{"пользователь":<16}{"DRF мс":>9}{"быстрый мс":>12}'
+            f'{"ускорение":>11}{"JSON":>8}')
+        mismatches = 0
+        for name, user in self.get_users():
+            request = Request(factory.get('/api/recipes/'))
+            request.user = user
+            recipes = list(Recipe.objects.for_read(user).order_by(
+                '-pub_date', '-id')[:options['recipes']])
+            if not recipes:
+                raise CommandError(
+                    'Нет рецептов: сначала выполните seed_foodgram')
+            equal = (
+                self.render(RecipesReadSerializer, recipes, request)
+                == self.render(RecipesFastReadSerializer, recipes, request))
+            mismatches += not equal
+            slow = self.measure(
+                RecipesReadSerializer, recipes, request, options['repeat'])
+            fast = self.measure(
+                RecipesFastReadSerializer, recipes, request,
+                options['repeat'])
+            self.stdout.write(
+                f'{name:<16}{slow * 1000:>9.2f}{fast * 1000:>12.2f}'
+                f'{slow / fast:>10.1f}x'
+                f'{"да" if equal else "нет":>8}')
+        if mismatches:
+            raise CommandError('JSON сериализаторов различается')
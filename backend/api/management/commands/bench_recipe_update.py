@@ -0,0 +1,115 @@
+from time import perf_counter
+from types import SimpleNamespace
+
+from api.serializers import RecipesWriteSerializer
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from recipes.models import Ingredient, IngredientInRecipesAmount, Recipe, Tag
+from users.models import User
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def legacy_update(recipe, tags, ingredients):
+    """Прежнее обновление рецепта: очистка и повторная вставка строк."""
+
+    recipe.tags.clear()
+    recipe.tags.set(tags)
+    recipe.ingredients.clear()
+    IngredientInRecipesAmount.objects.bulk_create(
+        [IngredientInRecipesAmount(
+            ingredient=ingredient['id'],
+            recipe=recipe,
+            amount=ingredient['amount'],
+        ) for ingredient in ingredients])
+
+
+def diff_update(recipe, tags, ingredients):
+    serializer = RecipesWriteSerializer(
+        context={'request': SimpleNamespace(user=recipe.author)})
+    serializer.update(recipe, {'tags': tags, 'recipe': ingredients})
+
+
+def snapshot(recipe):
+    return (
+        dict(IngredientInRecipesAmount.objects.filter(
+            recipe=recipe).values_list('pk', 'amount')),
+        dict(Recipe.tags.through.objects.filter(
+            recipe=recipe).values_list('pk', 'tag_id')))
+
+
+def rows_written(before, after):
+    """Число вставленных, измененных и удаленных строк связей."""
+
+    written = 0
+    for old, new in zip(before, after):
+        written += len(old.keys() ^ new.keys())
+        written += sum(old[pk] != new[pk] for pk in old.keys() & new.keys())
+    return written
+
+
+class Command(BaseCommand):
+    help = "Сравнение объема записи при обновлении рецепта"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ingredients', type=int, default=15,
+            help='число ингредиентов в рецепте')
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='число повторов каждого сценария')
+
+    def handle(self, *args, **options):
+        size = options['ingredients']
+        with transaction.atomic():
+            self.run(size, options['repeat'])
+            transaction.set_rollback(True)
+
+    def run(self, size, repeat):
+        author = User.objects.create(
+            email='bench@foodgram.local', username='bench-update')
+        tags = [
+            Tag.objects.create(
+                name=f'bench-{i}', color=f'#bench{i}', slug=f'bench-{i}')
+            for i in range(3)]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'bench-{i}', measurement_unit='г')
+            for i in range(size + 1)]
+        base = [{'id': ingredient, 'amount': 10}
+                for ingredient in ingredients[:size]]
+        scenarios = {
+            'только название': lambda: base,
+            'одно количество': lambda: (
+                [{'id': ingredients[0], 'amount': 11}] + base[1:]),
+            'замена ингредиента': lambda: (
+                base[:-1] + [{'id': ingredients[size], 'amount': 10}]),
+        }
+        self.stdout.write(
+            f'{"сценарий":<20}{"способ":<10}{"запросов":>10}'
+            f'{"строк":>8}{"мс":>10}')
+        for name, make in scenarios.items():
+            for label, update in (('прежний', legacy_update),
+                                  ('разница', diff_update)):
+                statements = rows = 0
+                elapsed = 0.0
+                for _ in range(repeat):
+                    recipe = Recipe.objects.create(
+                        author=author, name='bench', text='bench',
+                        cooking_time=1, image='recipes/bench.png')
+                    recipe.tags.set(tags[:2])
+                    legacy_update(recipe, tags[:2], base)
+                    before = snapshot(recipe)
+                    with CaptureQueriesContext(connection) as queries:
+                        started = perf_counter()
+                        update(recipe, tags[:2], make())
+                        elapsed += perf_counter() - started
+                    statements += sum(
+                        query['sql'].lstrip().upper().startswith(
+                            WRITE_STATEMENTS)
+                        for query in queries.captured_queries)
+                    rows += rows_written(before, snapshot(recipe))
+                self.stdout.write(
+                    f'{name:<20}{label:<10}{statements / repeat:>10.1f}'
+                    f'{rows / repeat:>8.1f}{elapsed / repeat * 1000:>10.2f}')
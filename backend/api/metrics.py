@@ -0,0 +1,241 @@
+import hmac
+import re
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# Показатели пула подключений, которые не являются счетчиками.
+DB_GAUGES = frozenset(('pool_idle', 'pool_in_use'))
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+CURRENT_STATS = ContextVar('request_stats', default=None)
+
+
+def query_shape(sql):
+    """Вид запроса: SQL без параметров и с одинаковыми списками IN."""
+
+    return IN_LIST.sub('IN (...)', sql)
+
+
+class RequestStats:
+    """Метрики одного запроса: SQL, сериализация и повторы запросов."""
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.shapes = Counter()
+        self.connects = 0
+        self.connect_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обертка connection.execute_wrapper."""
+
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += perf_counter() - started
+            self.sql_count += 1
+            self.shapes[sql] += 1
+
+    @contextmanager
+    def capture(self):
+        """Учет SQL всех подключений текущего потока."""
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield
+
+    def repeated_queries(self):
+        """Виды запросов, повторенные в запросе не реже порога N+1."""
+
+        shapes = Counter()
+        for sql, count in self.shapes.items():
+            shapes[query_shape(sql)] += count
+        return {
+            shape: count for shape, count in shapes.items()
+            if count >= settings.REQUEST_METRICS_NPLUSONE_THRESHOLD}
+
+    def server_timing(self, total):
+        return (
+            f'sql;dur={self.sql_time * 1000:.1f};'
+            f'desc="{self.sql_count} queries", '
+            f'serializer;dur={self.serializer_time * 1000:.1f}, '
+            f'db-connect;dur={self.connect_time * 1000:.1f};'
+            f'desc="{self.connects} connects", '
+            f'total;dur={total * 1000:.1f}')
+
+
+@contextmanager
+def serializer_timer():
+    """Учет времени сериализации; вложенные вызовы не суммируются."""
+
+    stats = CURRENT_STATS.get()
+    if stats is None:
+        yield
+        return
+    stats.serializer_depth += 1
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_depth -= 1
+        if not stats.serializer_depth:
+            stats.serializer_time += perf_counter() - started
+
+
+class MetricsRegistry:
+    """
+    Счетчики запросов процесса в формате Prometheus.
+
+    Каждый процесс сервера ведет свои счетчики; Prometheus
+    суммирует их по экземплярам.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.requests = Counter()
+        self.durations = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+        self.duration_sum = Counter()
+        self.duration_count = Counter()
+        self.sampled = Counter()
+        self.sql_count = Counter()
+        self.sql_time = Counter()
+        self.serializer_time = Counter()
+        self.nplusone = Counter()
+        self.connects = Counter()
+        self.connect_time = Counter()
+
+    def observe(self, view, method, status, duration, stats=None,
+                nplusone=False):
+        with self.lock:
+            self.requests[view, method, status] += 1
+            buckets = self.durations[view]
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    buckets[index] += 1
+            self.duration_sum[view] += duration
+            self.duration_count[view] += 1
+            if stats is None:
+                return
+            self.sampled[view] += 1
+            self.sql_count[view] += stats.sql_count
+            self.sql_time[view] += stats.sql_time
+            self.serializer_time[view] += stats.serializer_time
+            if nplusone:
+                self.nplusone[view] += 1
+
+    def observe_connect(self, alias, duration):
+        with self.lock:
+            self.connects[alias] += 1
+            self.connect_time[alias] += duration
+
+    def render(self):
+        lines = []
+
+        def counter(name, help_text, values, labels=('view',)):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for key, value in sorted(values.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                pairs = ','.join(
+                    f'{label}="{part}"' for label, part in zip(labels, key))
+                lines.append(f'{name}{{{pairs}}} {value}')
+
+        with self.lock:
+            counter('foodgram_requests_total', 'Число запросов.',
+                    self.requests, ('view', 'method', 'status'))
+            name = 'foodgram_request_duration_seconds'
+            lines.append(f'# HELP {name} Время обработки запроса.')
+            lines.append(f'# TYPE {name} histogram')
+            for view, buckets in sorted(self.durations.items()):
+                for bound, value in zip(DURATION_BUCKETS, buckets):
+                    lines.append(
+                        f'{name}_bucket{{view="{view}",le="{bound}"}} {value}')
+                lines.append(
+                    f'{name}_bucket{{view="{view}",le="+Inf"}} '
+                    f'{self.duration_count[view]}')
+                lines.append(
+                    f'{name}_sum{{view="{view}"}} {self.duration_sum[view]}')
+                lines.append(
+                    f'{name}_count{{view="{view}"}} '
+                    f'{self.duration_count[view]}')
+            counter('foodgram_sampled_requests_total',
+                    'Число запросов с подробными метриками.', self.sampled)
+            counter('foodgram_sql_queries_total',
+                    'Число SQL-запросов в выборке.', self.sql_count)
+            counter('foodgram_sql_duration_seconds_total',
+                    'Время SQL-запросов в выборке.', self.sql_time)
+            counter('foodgram_serializer_duration_seconds_total',
+                    'Время сериализации в выборке.', self.serializer_time)
+            counter('foodgram_nplusone_requests_total',
+                    'Число запросов с повторяющимися SQL-запросами.',
+                    self.nplusone)
+            counter('foodgram_db_connects_total',
+                    'Число получений подключения к базе.',
+                    self.connects, ('alias',))
+            counter('foodgram_db_connect_seconds_total',
+                    'Время получения подключений к базе.',
+                    self.connect_time, ('alias',))
+        # Одна строка TYPE на метрику, под ней значения всех баз.
+        db_stats = {}
+        for alias in connections:
+            stats = getattr(connections[alias], 'connection_stats', None)
+            for name, value in (stats() if stats else {}).items():
+                db_stats.setdefault(name, {})[alias] = value
+        for name, values in sorted(db_stats.items()):
+            kind = 'gauge' if name in DB_GAUGES else 'counter'
+            suffix = '' if kind == 'gauge' else '_total'
+            name = f'foodgram_db_{name}{suffix}'
+            lines.append(f'# TYPE {name} {kind}')
+            for alias, value in sorted(values.items()):
+                lines.append(f'{name}{{alias="{alias}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    duration = getattr(connection, 'connect_time', 0.0)
+    REGISTRY.observe_connect(connection.alias, duration)
+    stats = CURRENT_STATS.get()
+    if stats is not None:
+        stats.connects += 1
+        stats.connect_time += duration
+
+
+def metrics_allowed(request):
+    """Доступ по токену METRICS_TOKEN или с адресов METRICS_ALLOWED_IPS."""
+
+    token = settings.METRICS_TOKEN
+    header = request.headers.get('Authorization', '')
+    if token and hmac.compare_digest(header, f'Bearer {token}'):
+        return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    """
+    Метрики в текстовом формате Prometheus.
+
+    Без токена и с чужого адреса страница не существует.
+    """
+
+    if not metrics_allowed(request):
+        raise Http404
+    return HttpResponse(
+        REGISTRY.render(), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import random
+from time import perf_counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+from foodgram.db.routers import ROUTE, choose_route, remember_write
+from recipes.cache import request_versions
+
+from .metrics import CURRENT_STATS, REGISTRY, RequestStats
+
+logger = logging.getLogger(__name__)
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+class RequestMetricsMiddleware(MiddlewareMixin):
+    """
+    Метрики запросов: число и время SQL, время сериализации и общее время.
+
+    Подробные метрики собираются для доли запросов
+    REQUEST_METRICS_SAMPLE_RATE и отдаются в заголовке Server-Timing;
+    для остальных учитывается только время ответа. Повторы одного вида
+    SQL-запроса не реже REQUEST_METRICS_NPLUSONE_THRESHOLD раз
+    записываются в журнал как признак N+1.
+    """
+
+    def __call__(self, request):
+        started = perf_counter()
+        if not self.sampled():
+            response = self.get_response(request)
+            return self.finish(request, response, started)
+        stats = RequestStats()
+        token = CURRENT_STATS.set(stats)
+        try:
+            with stats.capture():
+                response = self.get_response(request)
+        finally:
+            CURRENT_STATS.reset(token)
+        return self.finish(request, response, started, stats)
+
+    @staticmethod
+    def sampled():
+        return random.random() < settings.REQUEST_METRICS_SAMPLE_RATE
+
+    @staticmethod
+    def finish(request, response, started, stats=None):
+        total = perf_counter() - started
+        if stats is None:
+            REGISTRY.observe(
+                get_view_name(request), request.method,
+                response.status_code, total)
+            return response
+        repeated = stats.repeated_queries()
+        REGISTRY.observe(
+            get_view_name(request), request.method, response.status_code,
+            total, stats, bool(repeated))
+        for shape, count in repeated.items():
+            logger.warning(
+                'N+1 в %s %s: запрос выполнен %d раз: %s',
+                request.method, request.path, count, shape)
+        response['Server-Timing'] = stats.server_timing(total)
+        return response
+
+
+class ReplicaRoutingMiddleware(MiddlewareMixin):
+    """
+    Чтение безопасных запросов с реплик базы из DATABASE_REPLICAS.
+
+    Реплика выбирается на весь запрос. После успешного изменения данных
+    или входа клиент REPLICA_STICKY_SECONDS секунд читает с основной
+    базы, чтобы видеть свои изменения, пока они доходят до реплик.
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token = ROUTE.set(choose_route(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            ROUTE.reset(token)
+        remember_write(request, response)
+        return response
+
+    async def __acall__(self, request):
+        route = await sync_to_async(
+            choose_route, thread_sensitive=False)(request)
+        token = ROUTE.set(route)
+        try:
+            response = await self.get_response(request)
+        finally:
+            ROUTE.reset(token)
+        await sync_to_async(
+            remember_write, thread_sensitive=False)(request, response)
+        return response
+
+
+class RequestVersionsMiddleware(MiddlewareMixin):
+    """Версии кэшей читаются не больше одного раза за запрос."""
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with request_versions():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with request_versions():
+            return await self.get_response(request)
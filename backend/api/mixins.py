@@ -0,0 +1,166 @@
+import time
+from hashlib import md5
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+from foodgram.db.routers import use_primary
+from recipes.response_cache import RESPONSE_CACHE
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from .metrics import serializer_timer
+
+
+class ReferenceCacheMixin:
+    """Чтение справочника из кэша в памяти с поддержкой ETag."""
+
+    reference_cache = None
+
+    def get_queryset(self):
+        if self.request.method in SAFE_METHODS:
+            return self.reference_cache.all()
+        return super().get_queryset()
+
+    def get_object(self):
+        if self.request.method not in SAFE_METHODS:
+            return super().get_object()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = self.reference_cache.get(int(self.kwargs[lookup_url_kwarg]))
+        except ValueError:
+            obj = None
+        if obj is None:
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        etag = self.reference_cache.get_etag()
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+
+class TimedSerializerMixin:
+    """Учет времени сериализации в метриках запроса."""
+
+    def to_representation(self, instance):
+        with serializer_timer():
+            return super().to_representation(instance)
+
+
+class AnonymousResponseCacheMixin:
+    """
+    Кэш готовых ответов list и retrieve для анонимных пользователей.
+
+    Ключ строится из адреса и нормализованных параметров запроса. Ответ
+    из кэша и ответ 304 на условный запрос отдаются без сборки ответа:
+    читаются только версии данных (из базы, если общий кэш не задан).
+    """
+
+    response_cache_params = frozenset((
+        'tags', 'author', 'ordering', 'page', 'limit',
+        'pagination', 'cursor', 'count'))
+    # Фильтры пользователя, которые для анонимного запроса ничего не меняют.
+    response_cache_ignored_params = frozenset((
+        'is_favorited', 'is_in_shopping_cart'))
+    response_cache_max_recipes = 100
+
+    def get_response_cache_key(self, request):
+        if (settings.RESPONSE_CACHE_TIMEOUT <= 0
+                or request.user.is_authenticated
+                or request.accepted_renderer.format != 'json'):
+            return None
+        params = []
+        for name, values in request.query_params.lists():
+            if name in self.response_cache_ignored_params:
+                continue
+            if name not in self.response_cache_params:
+                return None
+            params.append((name, sorted(values)))
+        url = request.build_absolute_uri(request.path)
+        query = urlencode(sorted(params), doseq=True)
+        return md5(f'{url}?{query}'.encode()).hexdigest()
+
+    def get_response_dependencies(self, recipes):
+        """Зависимости ответа из сериализованных рецептов."""
+
+        if len(recipes) > self.response_cache_max_recipes:
+            return None
+        dependencies = {'all'}
+        for recipe in recipes:
+            dependencies.add(f'recipe:{recipe["id"]}')
+            dependencies.add(f'user:{recipe["author"]["id"]}')
+        return dependencies
+
+    def cached_response(self, request, entry, response):
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = http_date(entry['last_modified'])
+        return get_conditional_response(
+            request, etag=entry['etag'],
+            last_modified=entry['last_modified'], response=response)
+
+    def get_cached_response(self, handler, dependencies, request,
+                            *args, **kwargs):
+        key = self.get_response_cache_key(request)
+        if key is None:
+            return handler(request, *args, **kwargs)
+        entry = RESPONSE_CACHE.get(key)
+        if entry is not None:
+            return self.cached_response(request, entry, HttpResponse(
+                entry['content'], content_type=entry['content_type']))
+        # Ответ попадет в кэш, поэтому он не должен отставать, как реплика.
+        use_primary()
+        started = time.time_ns()
+        response = handler(request, *args, **kwargs)
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        dependencies = dependencies(response.data)
+        if dependencies is None:
+            return response
+
+        def store(rendered):
+            entry = RESPONSE_CACHE.set(
+                key, rendered.content, rendered['Content-Type'],
+                dependencies, started)
+            if entry is not None:
+                rendered['ETag'] = entry['etag']
+                rendered['Last-Modified'] = http_date(entry['last_modified'])
+
+        response.add_post_render_callback(store)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        def dependencies(data):
+            recipes = data['results'] if isinstance(data, dict) else data
+            found = self.get_response_dependencies(recipes)
+            if found is not None:
+                found.add('list')
+                if request.query_params.get('ordering') == '-favorites_count':
+                    found.add('popular')
+            return found
+
+        return self.get_cached_response(
+            super().list, dependencies, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve,
+            lambda data: self.get_response_dependencies([data]),
+            request, *args, **kwargs)
@@ -1,6 +1,230 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+
+from django.conf import settings
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from recipes.feed import older_than
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class LimitPaginator(PageNumberPagination):
     """Класс пагинации страниц."""
     page_size_query_param = 'limit'
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по плану запроса PostgreSQL без COUNT(*)."""
+
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CountPaginator(Paginator):
+    """
+    Пагинатор с точным count без аннотаций запроса.
+
+    COUNT(*) по queryset с аннотациями считает их подзапросы для каждой
+    строки; для подсчета выбираются только первичные ключи.
+    """
+
+    @cached_property
+    def count(self):
+        return self.object_list.values('pk').count()
+
+
+class UncountedPage(Page):
+    """Страница, наличие следующей страницы у которой известно заранее."""
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self.more = has_next
+
+    def has_next(self):
+        return self.more
+
+
+class UncountedPaginator(Paginator):
+    """
+    Пагинатор без COUNT(*).
+
+    Следующая страница определяется по одной лишней строке выборки.
+    """
+
+    def validate_number(self, number):
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('Номер страницы не является числом')
+        if number < 1:
+            raise EmptyPage('Номер страницы меньше 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        items = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not items and number > 1:
+            raise EmptyPage('На этой странице нет результатов')
+        return UncountedPage(
+            items[:self.per_page], number, self, len(items) > self.per_page)
+
+    @cached_property
+    def count(self):
+        return None
+
+    @cached_property
+    def num_pages(self):
+        """Число страниц неизвестно."""
+
+        return 0
+
+
+class EstimatedCountPaginator(UncountedPaginator):
+    """Пагинатор с оценкой общего числа объектов по плану запроса."""
+
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+
+class RecipePaginator(LimitPaginator):
+    """
+    Пагинация рецептов.
+
+    По умолчанию страницы по номеру с точным count. Параметр
+    count=estimated заменяет COUNT(*) оценкой, count=none отключает
+    подсчет. Параметр pagination=cursor или cursor=<курсор> включает
+    курсорную пагинацию без OFFSET и подсчета.
+    """
+
+    count_query_param = 'count'
+    count_paginator_classes = {
+        'exact': CountPaginator,
+        'estimated': EstimatedCountPaginator,
+        'none': UncountedPaginator,
+    }
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (request.query_params.get('pagination') == 'cursor'
+                or RecipeCursorPaginator.cursor_query_param
+                in request.query_params):
+            self.cursor_paginator = RecipeCursorPaginator()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        self.django_paginator_class = self.count_paginator_classes.get(
+            request.query_params.get(self.count_query_param), CountPaginator)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class FeedCursorPaginator(BasePagination):
+    """
+    Курсорная пагинация ленты подписок по (pub_date, recipe_id).
+
+    Страница собирается функцией fetch(position, size), которая
+    возвращает позиции после курсора; курсор указывает на последнюю
+    позицию страницы.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = settings.RECIPES_PAGE_SIZE
+    max_page_size = 100
+    invalid_cursor_message = 'Неверный курсор'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            pub_date, recipe_id = b64decode(
+                encoded.encode('ascii')).decode('ascii').split('|')
+            position = (parse_datetime(pub_date), int(recipe_id))
+        except (BinasciiError, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if position[0] is None:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position):
+        pub_date, recipe_id = position
+        return b64encode(
+            f'{pub_date.isoformat()}|{recipe_id}'.encode('ascii'),
+        ).decode('ascii')
+
+    def get_position(self, item):
+        """Позиция (pub_date, id) элемента страницы."""
+
+        return item
+
+    def paginate_positions(self, fetch, request):
+        self.request = request
+        self.position = self.decode_cursor(request)
+        size = self.get_page_size(request)
+        positions = fetch(self.position, size + 1)
+        self.has_next = len(positions) > size
+        self.positions = positions[:size]
+        return self.positions
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param,
+            self.encode_cursor(self.get_position(self.positions[-1])))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
+
+
+class RecipeCursorPaginator(FeedCursorPaginator):
+    """
+    Курсорная пагинация рецептов по (pub_date, id).
+
+    Курсор хранит обе колонки последнего рецепта страницы, и следующая
+    страница выбирается условием по паре по индексу
+    recipe_pub_date_id_idx, без OFFSET даже при одинаковой дате.
+    """
+
+    def get_position(self, recipe):
+        return recipe.pub_date, recipe.pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_positions(
+            lambda position, size: list(queryset.filter(
+                older_than(position, 'pub_date', 'id'),
+            ).order_by('-pub_date', '-id')[:size]),
+            request)
@@ -0,0 +1,109 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_executor():
+    """
+    Пул потоков для обработки запросов под ASGI.
+
+    Django 3.2 не умеет обращаться к базе без потоков, поэтому пул из
+    ASYNC_DB_POOL_SIZE потоков с постоянными подключениями (CONN_MAX_AGE)
+    служит пулом подключений: их число не зависит от числа запросов.
+    """
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_DB_POOL_SIZE,
+                thread_name_prefix='async-db')
+        return _executor
+
+
+class PooledHandlerMixin:
+    """
+    Обработка запроса под ASGI целиком в пуле потоков.
+
+    Это не асинхронные представления: в Django 3.2 нет асинхронного
+    доступа к базе. Синхронные middleware и представления Django 3.2 под
+    ASGI выполняет в одном общем потоке, и каждый запрос переходит туда и
+    обратно на каждом middleware. Здесь цепочка middleware загружается
+    синхронной и вместе с представлением выполняется в потоке пула, как
+    под WSGI, а цикл событий только принимает запросы и отдает ответы.
+    """
+
+    def load_middleware(self, is_async=False):
+        super().load_middleware(is_async=False)
+
+    async def get_response_async(self, request):
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            get_executor(), partial(context.run, self.run_in_pool, request))
+
+    def run_in_pool(self, request):
+        close_old_connections()
+        try:
+            return self.get_response(request)
+        finally:
+            close_old_connections()
+
+    async def send_response(self, response, send):
+        """
+        Тело потокового ответа читается из базы в потоке пула.
+
+        Части тела по одной передаются в цикл событий сервера, и
+        следующая читается только после отправки предыдущей.
+        """
+
+        if not response.streaming:
+            return await super().send_response(response, send)
+        headers = [
+            (header.encode('ascii'), value.encode('latin1'))
+            for header, value in response.items()]
+        headers.extend(
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values())
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': headers,
+        })
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(get_executor(), partial(
+            context.run, self.send_body_in_pool, response, send, loop))
+        await send({'type': 'http.response.body'})
+
+    def send_body_in_pool(self, response, send, loop):
+        close_old_connections()
+        try:
+            for part in response:
+                for chunk, _ in self.chunk_bytes(part):
+                    asyncio.run_coroutine_threadsafe(send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    }), loop).result()
+        finally:
+            response.close()
+            close_old_connections()
+
+
+class PooledASGIHandler(PooledHandlerMixin, ASGIHandler):
+    """Обработчик ASGI, выполняющий запросы в пуле потоков."""
+
+
+def get_asgi_application():
+    django.setup(set_prefix=False)
+    return PooledASGIHandler()
@@ -1,13 +1,84 @@
-import base64
-
-from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
 from foodgram.settings import MIN_VALUE
-from recipes.models import Ingredient, IngredientInRecipesAmount, Recipe, Tag
-from rest_framework.serializers import (CharField, ImageField, ModelSerializer,
+from recipes.cache import REFERENCE_CACHES
+from recipes.models import (Ingredient, IngredientInRecipesAmount, Recipe,
+                            ShoppingCartIngredient, Tag)
+from rest_framework.relations import MANY_RELATION_KWARGS, ManyRelatedField
+from rest_framework.serializers import (CharField, Field, ImageField,
+                                        IntegerField, ListSerializer,
+                                        ModelSerializer,
                                         PrimaryKeyRelatedField, ReadOnlyField,
                                         SerializerMethodField, ValidationError)
 from users.models import Follow, User
 
+from .metrics import serializer_timer
+from .mixins import TimedSerializerMixin
+from .utils import decode_base64_image
+
+
+def get_recipes_limit(request):
+    """Значение параметра recipes_limit из запроса или None."""
+
+    recipes_limit = request.query_params.get('recipes_limit')
+    if recipes_limit is None or not recipes_limit.isdigit():
+        return None
+    return int(recipes_limit)
+
+
+class ReferencePrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """Поле первичного ключа справочника с поиском объекта в кэше."""
+
+    default_error_messages = {
+        'does_not_exist_many': (
+            'Недопустимые первичные ключи {pk_values} - '
+            'объекты не существуют.'),
+    }
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return ReferenceManyRelatedField(**list_kwargs)
+
+    def to_internal_value(self, data):
+        return self.to_internal_value_many([data])[0]
+
+    def to_internal_value_many(self, data):
+        """Поиск всех объектов списка за одно обращение к кэшу."""
+
+        pks = []
+        for item in data:
+            if self.pk_field is not None:
+                item = self.pk_field.to_internal_value(item)
+            try:
+                if isinstance(item, bool):
+                    raise TypeError
+                pks.append(int(item))
+            except (TypeError, ValueError):
+                self.fail('incorrect_type', data_type=type(item).__name__)
+        reference_cache = REFERENCE_CACHES[self.get_queryset().model]
+        objects = reference_cache.get_many(pks)
+        missing = [str(pk) for pk in dict.fromkeys(pks) if pk not in objects]
+        if len(missing) == 1:
+            self.fail('does_not_exist', pk_value=missing[0])
+        if missing:
+            self.fail('does_not_exist_many', pk_values=', '.join(missing))
+        return [objects[pk] for pk in pks]
+
+
+class ReferenceManyRelatedField(ManyRelatedField):
+    """Список первичных ключей справочника, проверяемый целиком."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return self.child_relation.to_internal_value_many(data)
+
 
 class TagSerializer(ModelSerializer):
     """Сериализация Tags. Список тегов."""
@@ -26,12 +97,44 @@ class Base64ImageField(ImageField):
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = decode_base64_image(data)
         return super().to_internal_value(data)
 
 
+def image_variant_urls(recipe, request=None):
+    """Адреса готовых копий фотографии: {размер: {формат: адрес}}."""
+
+    variants = recipe.image_variants
+    if not recipe.image or variants.get('source') != recipe.image.name:
+        return {}
+    urls = {}
+    for variant, files in variants.items():
+        if variant == 'source':
+            continue
+        urls[variant] = {}
+        for extension, path in files.items():
+            url = default_storage.url(path)
+            urls[variant][extension] = (
+                request.build_absolute_uri(url) if request else url)
+    return urls
+
+
+class ImageVariantsField(Field):
+    """
+    Адреса уменьшенных копий фотографии рецепта.
+
+    Пока копии не готовы, возвращается пустой словарь.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        return image_variant_urls(recipe, self.context.get('request'))
+
+
 class IngredientSerializer(ModelSerializer):
     """Сериализатор Ingredients. Список ингредиентов."""
     class Meta:
@@ -56,7 +159,7 @@ class IngredientsInRecipeReadSerializer(ModelSerializer):
             'amount')
 
 
-class UserSerializer(ModelSerializer):
+class UserSerializer(TimedSerializerMixin, ModelSerializer):
     """Сериализация User'a. Просмотр пользователя."""
 
     is_subscribed = SerializerMethodField(read_only=True)
@@ -72,7 +175,8 @@ class UserSerializer(ModelSerializer):
             'is_subscribed',)
 
     def get_is_subscribed(self, obj):
-
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         if user is None or user.is_anonymous:
             return False
@@ -89,10 +193,11 @@ class UserCreateSerializer(ModelSerializer):
             'first_name', 'last_name', 'password',)
 
 
-class ShoppingListFavoiriteSerializer(ModelSerializer):
+class ShoppingListFavoiriteSerializer(TimedSerializerMixin, ModelSerializer):
     """Сериализация shoppingLists. Лист покупок."""
 
     image = Base64ImageField(read_only=True)
+    image_variants = ImageVariantsField()
     name = ReadOnlyField()
     cooking_time = ReadOnlyField()
 
@@ -102,20 +207,16 @@ class ShoppingListFavoiriteSerializer(ModelSerializer):
             'id',
             'name',
             'image',
+            'image_variants',
             'cooking_time',)
 
 
-class FollowSerializer(ModelSerializer):
-    """Сериализация объектов типа Follow. Проверка подписки."""
+class FollowSerializer(TimedSerializerMixin, ModelSerializer):
+    """Сериализация авторов в подписках. Проверка подписки."""
 
-    email = ReadOnlyField(source='author.email')
-    id = ReadOnlyField(source='author.id')
-    username = ReadOnlyField(source='author.username')
-    first_name = ReadOnlyField(source='author.first_name')
-    last_name = ReadOnlyField(source='author.last_name')
     is_subscribed = SerializerMethodField()
     recipes = SerializerMethodField()
-    recipes_count = SerializerMethodField()
+    recipes_count = ReadOnlyField()
 
     class Meta:
         model = User
@@ -128,9 +229,19 @@ class FollowSerializer(ModelSerializer):
             'is_subscribed',
             'recipes',
             'recipes_count',)
+        read_only_fields = (
+            'email',
+            'username',
+            'first_name',
+            'last_name',)
 
     def get_is_subscribed(self, obj):
-        return Follow.objects.filter(user=obj.user, author=obj.author).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        user = self.context.get('request').user
+        return (
+            user.is_authenticated
+            and Follow.objects.filter(user=user, author=obj).exists())
 
     def validate(self, data):
         author = self.instance
@@ -143,31 +254,43 @@ class FollowSerializer(ModelSerializer):
                 'Нельзя подписаться на самого себя!')
         return data
 
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.author).count()
-
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        query_params = request.query_params
-        queryset = Recipe.objects.filter(author=obj.author)
-        if 'recipes_limit' in query_params:
-            recipes_limit = query_params['recipes_limit']
-            queryset = queryset[:int(recipes_limit)]
+        if hasattr(obj, 'limited_recipes'):
+            queryset = obj.limited_recipes
+        else:
+            queryset = obj.recipes.all()
+            recipes_limit = get_recipes_limit(self.context.get('request'))
+            if recipes_limit is not None:
+                queryset = queryset[:recipes_limit]
         serializer = ShoppingListFavoiriteSerializer(queryset, many=True)
         return serializer.data
 
 
+class IngredientsInRecipeListSerializer(ListSerializer):
+    """Список ингредиентов рецепта с проверкой всех id сразу."""
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        ingredients = ReferencePrimaryKeyRelatedField(
+            queryset=Ingredient.objects.all(),
+        ).to_internal_value_many([item['id'] for item in items])
+        for item, ingredient in zip(items, ingredients):
+            item['id'] = ingredient
+        return items
+
+
 class IngredientsInRecipeWriteSerializer(ModelSerializer):
     """Сериализатор добавления ингредиента в рецепт."""
 
-    id = PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = IntegerField()
 
     class Meta:
         model = IngredientInRecipesAmount
         fields = ('id', 'amount',)
+        list_serializer_class = IngredientsInRecipeListSerializer
 
 
-class RecipesReadSerializer(ModelSerializer):
+class RecipesReadSerializer(TimedSerializerMixin, ModelSerializer):
     """Сериализация Recipes. Чтение рецептов."""
 
     is_favorited = SerializerMethodField(read_only=True)
@@ -177,6 +300,7 @@ class RecipesReadSerializer(ModelSerializer):
     tags = TagSerializer(many=True)
     author = UserSerializer(read_only=True)
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -187,28 +311,143 @@ class RecipesReadSerializer(ModelSerializer):
             'ingredients',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time',
             'is_favorited',
             'is_in_shopping_cart',)
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         return (
             user.is_authenticated
             and obj.favorite_recipes.filter(user=user).exists())
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         return (
             user.is_authenticated
             and obj.shopping_recipes.filter(user=user).exists())
 
 
+class RecipesFastReadSerializer:
+    """
+    Чтение рецептов без полей ModelSerializer.
+
+    Строит тот же JSON, что RecipesReadSerializer, прямо из объектов
+    Recipe.objects.for_read(): без разбора полей и вложенных
+    сериализаторов для каждого рецепта. Включается RECIPE_FAST_SERIALIZER.
+    """
+
+    def __init__(self, instance=None, many=False, context=None, **kwargs):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+        self.request = self.context.get('request')
+        self.tags = {}
+        self.authors = {}
+
+    @property
+    def data(self):
+        with serializer_timer():
+            if self.many:
+                return [self.recipe(recipe) for recipe in self.instance]
+            return self.recipe(self.instance)
+
+    def tag(self, tag):
+        data = self.tags.get(tag.pk)
+        if data is None:
+            data = self.tags[tag.pk] = {
+                'id': tag.pk,
+                'name': tag.name,
+                'color': tag.color,
+                'slug': tag.slug,
+            }
+        return data
+
+    def author(self, author):
+        data = self.authors.get(author.pk)
+        if data is None:
+            if hasattr(author, 'is_subscribed'):
+                is_subscribed = author.is_subscribed
+            else:
+                user = self.request.user if self.request else None
+                is_subscribed = (
+                    user is not None and user.is_authenticated
+                    and user.follower.filter(author=author).exists())
+            data = self.authors[author.pk] = {
+                'email': author.email,
+                'id': author.pk,
+                'username': author.username,
+                'first_name': author.first_name,
+                'last_name': author.last_name,
+                'is_subscribed': is_subscribed,
+            }
+        return data
+
+    @staticmethod
+    def prefetched(recipe, name):
+        """Предзагруженные объекты без создания менеджера связи."""
+
+        cache = getattr(recipe, '_prefetched_objects_cache', {})
+        if name in cache:
+            return cache[name]
+        return getattr(recipe, name).all()
+
+    @staticmethod
+    def ingredient(row):
+        ingredient = row.ingredient
+        return {
+            'id': ingredient.pk,
+            'name': ingredient.name,
+            'measurement_unit': ingredient.measurement_unit,
+            'amount': row.amount,
+        }
+
+    def image(self, image):
+        if not image:
+            return None
+        url = image.url
+        return self.request.build_absolute_uri(url) if self.request else url
+
+    def flag(self, recipe, name, related):
+        if hasattr(recipe, name):
+            return getattr(recipe, name)
+        user = self.request.user
+        return (
+            user.is_authenticated
+            and getattr(recipe, related).filter(user=user).exists())
+
+    def recipe(self, recipe):
+        return {
+            'id': recipe.pk,
+            'tags': [
+                self.tag(tag) for tag in self.prefetched(recipe, 'tags')],
+            'author': self.author(recipe.author),
+            'ingredients': [
+                self.ingredient(row)
+                for row in self.prefetched(recipe, 'recipe')],
+            'name': recipe.name,
+            'image': self.image(recipe.image),
+            'image_variants': image_variant_urls(recipe, self.request),
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'is_favorited': self.flag(
+                recipe, 'is_favorited', 'favorite_recipes'),
+            'is_in_shopping_cart': self.flag(
+                recipe, 'is_in_shopping_cart', 'shopping_recipes'),
+        }
+
+
 class RecipesWriteSerializer(ModelSerializer):
     """Сериализация Recipes. Запись рецептов."""
 
-    tags = PrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
+    tags = ReferencePrimaryKeyRelatedField(
+        many=True, queryset=Tag.objects.all())
     ingredients = IngredientsInRecipeWriteSerializer(many=True,
                                                      source='recipe')
     image = Base64ImageField()
@@ -233,19 +472,17 @@ class RecipesWriteSerializer(ModelSerializer):
         ingredients = data['recipe']
         tags = data['tags']
         cooking_time = data['cooking_time']
-        ingredients_list = []
         if not ingredients:
             raise ValidationError({
                 'Укажите ингредиенты!'})
         if not tags:
             raise ValidationError({
                 'Укажите тэг!'})
+        if len({ingredient['id'] for ingredient in ingredients}) != len(
+                ingredients):
+            raise ValidationError({
+                'Ингредиенты должны быть уникальными'})
         for ingredient in ingredients:
-            ingredient_id = ingredient['id']
-            if ingredient_id in ingredients_list:
-                raise ValidationError({
-                    'Ингредиенты должны быть уникальными'})
-            ingredients_list.append(ingredient_id)
             amount = ingredient['amount']
             if int(amount) == MIN_VALUE:
                 raise ValidationError({
@@ -269,6 +506,36 @@ class RecipesWriteSerializer(ModelSerializer):
                 amount=ingredient.get('amount'),
             ) for ingredient in ingredients])
 
+    def diff_update_ingredient(self, new_amounts, recipe):
+        """
+        Изменение состава рецепта только в отличающихся строках.
+
+        Возвращает прежние количества ингредиентов.
+        """
+
+        rows = {row.ingredient_id: row for row in recipe.recipe.all()}
+        old_amounts = {
+            ingredient_id: row.amount for ingredient_id, row in rows.items()}
+        changed = []
+        for ingredient_id, amount in new_amounts.items():
+            row = rows.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        removed = [
+            row.pk for ingredient_id, row in rows.items()
+            if ingredient_id not in new_amounts]
+        if removed:
+            IngredientInRecipesAmount.objects.filter(pk__in=removed).delete()
+        if changed:
+            IngredientInRecipesAmount.objects.bulk_update(changed, ['amount'])
+        IngredientInRecipesAmount.objects.bulk_create([
+            IngredientInRecipesAmount(
+                ingredient_id=ingredient_id, recipe=recipe, amount=amount)
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in rows])
+        return old_amounts
+
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('recipe')
@@ -278,17 +545,24 @@ class RecipesWriteSerializer(ModelSerializer):
         self.create_update_ingredient(ingredients, recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         request = self.context.get('request')
         req_usr_auth = request.user.is_authenticated
         if req_usr_auth and request.user.id == instance.author_id:
-            tags = validated_data.pop('tags')
-            instance.tags.clear()
-            instance.tags.set(tags)
-            ingredients = validated_data.pop('recipe')
-            instance.ingredients.clear()
-            self.create_update_ingredient(ingredients, instance)
-            return super().update(instance, validated_data)
+            instance.tags.set(validated_data.pop('tags'))
+            new_amounts = {
+                ingredient['id'].id: ingredient['amount']
+                for ingredient in validated_data.pop('recipe')}
+            old_amounts = self.diff_update_ingredient(new_amounts, instance)
+            ShoppingCartIngredient.objects.change_recipe(
+                instance, old_amounts, new_amounts)
+            # Сохраняются только переданные поля: image_variants в это
+            # время может обновить build_image_variants.
+            for field, value in validated_data.items():
+                setattr(instance, field, value)
+            instance.save(update_fields=list(validated_data))
+            return instance
         else:
             raise ValidationError('Вы не можете редактировать этот рецепт')
             return instance
@@ -0,0 +1,984 @@
+import base64
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+import psycopg2.extensions
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from foodgram.db.base import ConnectionPool, Database, DatabaseWrapper
+from foodgram.db.base import _stats as pool_stats
+from PIL import Image
+from recipes.cache import (INGREDIENT_CACHE, TAG_CACHE, request_versions,
+                           stamp_versions)
+from recipes.images import run_next_task, variant_files
+from recipes.models import (DataVersion, FavoriteReceipe, FeedEntry,
+                            ImageVariantsTask, Ingredient,
+                            IngredientInRecipesAmount, Recipe,
+                            RecipeIngredientChange, RecipeTrend, ShoppingCart,
+                            ShoppingCartIngredient, Tag, TrendingState)
+from recipes.response_cache import RESPONSE_CACHE
+from recipes.search import RecipeIngredientIndex
+from recipes.trending import REBASE_HALF_LIVES, growth, refresh_trending
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APITestCase
+from users.models import User
+
+from .utils import decode_base64_image, pdf_string
+
+RECIPES_COUNT = 50
+MEDIA_ROOT = tempfile.mkdtemp()
+CACHE_ROOT = tempfile.mkdtemp()
+REPLICA_ALIAS = 'replica_test'
+# Вторая база SQLite в роли реплики; тестовую базу для нее создает
+# запуск тестов, как и для основной.
+connections.databases.setdefault(REPLICA_ALIAS, {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': ':memory:',
+})
+
+
+def image_data_url(size=(4, 4)):
+    buffer = BytesIO()
+    Image.new('RGB', size).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()).decode()
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class RecipeListQueriesTest(APITestCase):
+    """Число запросов к базе у списка рецептов не зависит от его длины."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@example.com')
+        author = User.objects.create(
+            username='author', email='author@example.com')
+        tags = [
+            Tag.objects.create(
+                name=f'тэг {number}', color=f'#00000{number}',
+                slug=f'tag-{number}')
+            for number in range(2)]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(3)]
+        recipes = [
+            Recipe.objects.create(
+                author=author, name=f'рецепт {number}',
+                image='recipes/image.png', text='описание',
+                cooking_time=number + 1)
+            for number in range(RECIPES_COUNT)]
+        for recipe in recipes:
+            recipe.tags.set(tags)
+        IngredientInRecipesAmount.objects.bulk_create([
+            IngredientInRecipesAmount(
+                recipe=recipe, ingredient=ingredient, amount=10)
+            for recipe in recipes for ingredient in ingredients])
+        FavoriteReceipe.objects.bulk_create([
+            FavoriteReceipe(user=cls.user, recipe=recipe)
+            for recipe in recipes[::2]])
+        ShoppingCart.objects.bulk_create([
+            ShoppingCart(user=cls.user, recipe=recipe)
+            for recipe in recipes[::3]])
+        # Кэш тэгов процесса мог остаться от других тестов.
+        DataVersion.objects.bump([TAG_CACHE.counter.key])
+
+    def assert_list_queries(self, queries):
+        for limit in (1, RECIPES_COUNT):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(queries):
+                    response = self.client.get(
+                        '/api/recipes/', {'limit': limit})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous(self):
+        self.assert_list_queries(5)
+
+    def test_authenticated(self):
+        self.client.force_authenticate(self.user)
+        self.assert_list_queries(5)
+
+    def test_count_without_annotations(self):
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/', {'limit': 1})
+        self.assertEqual(response.data['count'], RECIPES_COUNT)
+        count_sql = next(
+            query['sql'] for query in queries.captured_queries
+            if 'COUNT(*)' in query['sql'])
+        self.assertNotIn('EXISTS', count_sql)
+
+    @override_settings(REFERENCE_CACHE_ALIAS=None)
+    def test_tags_filter(self):
+        params = {'tags': ['tag-0', 'tag-1'], 'limit': RECIPES_COUNT}
+        self.client.get('/api/recipes/', params)
+        # Тэги берутся из кэша: добавляется только проверка его версии.
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/recipes/', params)
+        self.assertEqual(len(response.data['results']), RECIPES_COUNT)
+
+    def test_flags(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/recipes/', {'limit': RECIPES_COUNT})
+        favorited = {
+            recipe['id'] for recipe in response.data['results']
+            if recipe['is_favorited']}
+        in_shopping_cart = {
+            recipe['id'] for recipe in response.data['results']
+            if recipe['is_in_shopping_cart']}
+        self.assertEqual(favorited, set(
+            FavoriteReceipe.objects.values_list('recipe_id', flat=True)))
+        self.assertEqual(in_shopping_cart, set(
+            ShoppingCart.objects.values_list('recipe_id', flat=True)))
+
+
+@override_settings(RECIPE_FAST_SERIALIZER=True)
+class FastRecipeListQueriesTest(RecipeListQueriesTest):
+    """То же для сериализатора RECIPE_FAST_SERIALIZER."""
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class RecipeCursorPaginationTest(APITestCase):
+    """Курсорная пагинация не пропускает рецепты с одинаковой датой."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username='author', email='author@example.com')
+        Recipe.objects.bulk_create([
+            Recipe(
+                author=author, name=f'рецепт {number}',
+                image='recipes/image.png', text='описание', cooking_time=1)
+            for number in range(7)])
+        pub_date = Recipe.objects.order_by('pk').first().pub_date
+        # Половина рецептов с одной датой: порядок задает id.
+        Recipe.objects.filter(
+            pk__in=Recipe.objects.order_by('pk').values('pk')[:4],
+        ).update(pub_date=pub_date)
+        cls.expected = list(Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('pk', flat=True))
+
+    def test_pages(self):
+        seen = []
+        params = {'pagination': 'cursor', 'limit': 3}
+        url = '/api/recipes/'
+        while url:
+            with self.assertNumQueries(4):
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            self.assertIsNone(response.data['previous'])
+            seen.extend(recipe['id'] for recipe in response.data['results'])
+            url, params = response.data['next'], None
+        self.assertEqual(seen, self.expected)
+
+    def test_invalid_cursor(self):
+        for cursor in ('not base64!', 'bm90LWEtZGF0ZXwx', 'w6k='):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    '/api/recipes/', {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_count_modes(self):
+        response = self.client.get(
+            '/api/recipes/', {'limit': 3, 'count': 'none'})
+        self.assertIsNone(response.data['count'])
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(
+            '/api/recipes/', {'limit': 3, 'page': 3, 'count': 'none'})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+        response = self.client.get(
+            '/api/recipes/', {'limit': 3, 'count': 'estimated'})
+        self.assertEqual(response.data['count'], len(self.expected))
+
+
+@override_settings(
+    RESPONSE_CACHE_TIMEOUT=0, TRENDING_HALF_LIFE_HOURS=1,
+    TRENDING_LAG_SECONDS=60)
+class TrendingTest(APITestCase):
+    """Рейтинг обновляется по новым событиям и затухает со временем."""
+
+    def setUp(self):
+        self.now = timezone.now()
+        author = User.objects.create(
+            username='author', email='author@example.com')
+        self.users = [
+            User.objects.create(
+                username=f'user{number}', email=f'user{number}@example.com')
+            for number in range(3)]
+        self.recipes = [
+            Recipe.objects.create(
+                author=author, name=f'рецепт {number}',
+                image='recipes/image.png', text='описание', cooking_time=1)
+            for number in range(3)]
+        # Начальное обновление: учтены события до now - 2 часов.
+        refresh_trending(self.now - timedelta(hours=2))
+
+    def favorite(self, user, recipe, created):
+        FavoriteReceipe.objects.create(
+            user=user, recipe=recipe, created=created)
+
+    def scores(self):
+        return dict(RecipeTrend.objects.values_list('recipe_id', 'score'))
+
+    def test_decay(self):
+        old, new, _ = self.recipes
+        for user in self.users[:2]:
+            self.favorite(user, old, self.now - timedelta(minutes=70))
+        self.favorite(self.users[0], new, self.now - timedelta(minutes=5))
+        self.assertEqual(refresh_trending(self.now), 3)
+        scores = self.scores()
+        # Два события на 65 минут старше весят меньше одного нового.
+        self.assertAlmostEqual(
+            scores[old.pk], scores[new.pk] * 2 ** (-1 / 12))
+        response = self.client.get('/api/recipes/trending/')
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data], [new.pk, old.pk])
+
+    def test_watermark(self):
+        recipe = self.recipes[0]
+        events = (
+            (1.0, self.now - timedelta(minutes=10)),
+            # Событие моложе TRENDING_LAG_SECONDS ждет следующего
+            # обновления.
+            (1.0, self.now - timedelta(seconds=30)),
+            (0.5, self.now - timedelta(minutes=5)))
+        self.favorite(self.users[0], recipe, events[0][1])
+        self.favorite(self.users[1], recipe, events[1][1])
+        ShoppingCart.objects.create(
+            user=self.users[2], recipe=recipe, created=events[2][1])
+        self.assertEqual(refresh_trending(self.now), 2)
+        self.assertEqual(refresh_trending(self.now), 0)
+        later = self.now + timedelta(minutes=1)
+        self.assertEqual(refresh_trending(later), 1)
+        state = TrendingState.objects.get()
+        self.assertEqual(state.watermark, later - timedelta(seconds=60))
+        self.assertAlmostEqual(
+            self.scores()[recipe.pk],
+            sum(weight * growth(created, state.epoch)
+                for weight, created in events))
+
+    def test_rebase(self):
+        first, second, _ = self.recipes
+        self.favorite(self.users[0], first, self.now - timedelta(minutes=30))
+        refresh_trending(self.now)
+        epoch = TrendingState.objects.get().epoch
+        later = self.now + timedelta(hours=REBASE_HALF_LIVES + 1)
+        created = later + timedelta(minutes=1)
+        self.favorite(self.users[1], first, created)
+        self.favorite(self.users[1], second, created)
+        self.favorite(self.users[2], second, created)
+        refresh_trending(later)
+        state = TrendingState.objects.get()
+        self.assertEqual(state.epoch, later - timedelta(seconds=60))
+        self.assertGreater(state.epoch, epoch)
+        # Старый рейтинг после сдвига точки отсчета ниже порога.
+        self.assertEqual(self.scores(), {})
+        refresh_trending(later + timedelta(minutes=5))
+        scores = self.scores()
+        self.assertAlmostEqual(scores[first.pk], growth(created, state.epoch))
+        self.assertAlmostEqual(scores[second.pk], scores[first.pk] * 2)
+
+
+@override_settings(FEED_FANOUT_MAX_FOLLOWERS=1, FEED_TIMELINE_LENGTH=3)
+class FeedTest(APITestCase):
+    """Лента подписок из записей ленты и рецептов популярных авторов."""
+
+    def setUp(self):
+        self.reader, self.author, self.popular, other = [
+            User.objects.create(username=name, email=f'{name}@example.com')
+            for name in ('reader', 'author', 'popular', 'other')]
+        self.client.force_authenticate(other)
+        self.subscribe(self.popular)
+        self.client.force_authenticate(self.reader)
+
+    def subscribe(self, author, method='post'):
+        response = getattr(self.client, method)(
+            f'/api/users/{author.pk}/subscribe/')
+        self.assertIn(response.status_code, (201, 204))
+
+    def create_recipes(self, author, count):
+        # Автор читается заново: число подписчиков меняется в тесте.
+        return [
+            Recipe.objects.create(
+                author_id=author.pk, name=f'рецепт {number}',
+                image='recipes/image.png', text='описание', cooking_time=1)
+            for number in range(count)]
+
+    def timeline(self):
+        return list(FeedEntry.objects.filter(user=self.reader).order_by(
+            '-pub_date', '-recipe_id').values_list('recipe_id', flat=True))
+
+    def feed(self, limit):
+        ids = []
+        params = {'limit': limit}
+        url = '/api/users/feed/'
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            url, params = response.data['next'], None
+        return ids
+
+    def test_backfill_and_trim(self):
+        recipes = self.create_recipes(self.author, 5)
+        self.subscribe(self.author)
+        self.assertEqual(
+            self.timeline(), [recipe.pk for recipe in recipes[:1:-1]])
+        recipe = self.create_recipes(self.author, 1)[0]
+        self.assertEqual(self.timeline()[0], recipe.pk)
+        self.assertEqual(len(self.timeline()), 4)
+        # Лишние записи удаляются при чтении первой страницы.
+        self.feed(limit=10)
+        self.assertEqual(
+            self.timeline(), [recipe.pk, recipes[4].pk, recipes[3].pk])
+
+    def test_fan_out_and_pull(self):
+        self.subscribe(self.author)
+        self.subscribe(self.popular)
+        recipes = []
+        for _ in range(3):
+            recipes += self.create_recipes(self.author, 1)
+            recipes += self.create_recipes(self.popular, 1)
+        # Рецепты популярного автора в ленты не рассылаются.
+        self.assertEqual(
+            self.timeline(),
+            [recipe.pk for recipe in reversed(recipes)
+             if recipe.author_id == self.author.pk])
+        self.assertEqual(
+            self.feed(limit=4), [recipe.pk for recipe in reversed(recipes)])
+
+    def test_prune(self):
+        self.create_recipes(self.author, 2)
+        self.subscribe(self.author)
+        self.subscribe(self.popular)
+        self.subscribe(self.author, method='delete')
+        self.assertEqual(self.timeline(), [])
+        popular_recipes = self.create_recipes(self.popular, 2)
+        self.assertEqual(
+            self.feed(limit=1),
+            [recipe.pk for recipe in reversed(popular_recipes)])
+        self.subscribe(self.popular, method='delete')
+        self.assertEqual(self.feed(limit=1), [])
+
+
+@override_settings(
+    INGREDIENT_SEARCH_BACKEND='memory', INGREDIENT_SEARCH_LIMIT=4)
+class IngredientSearchTest(APITestCase):
+    """Сначала совпадения по началу названия, затем внутри названия."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ids = {
+            name: Ingredient.objects.create(
+                name=name, measurement_unit='г').pk
+            for name in ('Сахар', 'сахарная пудра', 'Ванильный сахар',
+                         'тростниковый сахар', 'соль', 'Сахарин',
+                         'кокосовый сахар')}
+
+    def setUp(self):
+        # Версия по времени не повторится после отката транзакции теста,
+        # в отличие от увеличения на единицу.
+        stamp_versions([INGREDIENT_CACHE.counter.key])
+
+    def search(self, name):
+        response = self.client.get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['id'] for ingredient in response.data]
+
+    def test_ranking(self):
+        ids = self.ids
+        self.assertEqual(self.search('САХ'), [
+            ids['Сахар'], ids['Сахарин'], ids['сахарная пудра'],
+            ids['Ванильный сахар']])
+        # Без совпадений по началу названия порядок алфавитный.
+        self.assertEqual(self.search('ахар'), [
+            ids['Ванильный сахар'], ids['кокосовый сахар'], ids['Сахар'],
+            ids['Сахарин']])
+        self.assertEqual(
+            self.search('со'), [ids['соль'], ids['кокосовый сахар']])
+        self.assertEqual(self.search('перец'), [])
+        self.assertEqual(len(self.search('')), len(ids))
+
+    def test_new_ingredient(self):
+        self.search('сах')
+        ingredient = Ingredient.objects.create(
+            name='сахар-песок', measurement_unit='г')
+        stamp_versions([INGREDIENT_CACHE.counter.key])
+        self.assertEqual(
+            self.search('сахар-'), [ingredient.pk])
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    """Выдача, проверка и возврат подключений пула."""
+
+    def setUp(self):
+        self.alias = self.id()
+        self.opened = []
+        self.pool = ConnectionPool(
+            self.alias, self.connect, max_size=2, timeout=0.01,
+            max_lifetime=60)
+
+    def connect(self):
+        connection = mock.MagicMock(closed=0)
+        connection.info.transaction_status = (
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        self.opened.append(connection)
+        return connection
+
+    def stat(self, name):
+        return pool_stats[self.alias, name]
+
+    def test_reuse(self):
+        first = self.pool.acquire(health_check=False)
+        second = self.pool.acquire(health_check=False)
+        self.assertEqual(self.pool.stats(), {'pool_idle': 0, 'pool_in_use': 2})
+        self.pool.release(first)
+        self.pool.release(second)
+        # Последнее возвращенное подключение выдается первым.
+        self.assertIs(self.pool.acquire(health_check=False), second)
+        self.assertEqual(len(self.opened), 2)
+        self.assertEqual(self.stat('pool_reused'), 1)
+
+    def test_timeout(self):
+        self.pool.acquire(health_check=False)
+        connection = self.pool.acquire(health_check=False)
+        with self.assertRaises(Database.OperationalError):
+            self.pool.acquire(health_check=False)
+        self.assertEqual(self.stat('pool_timeouts'), 1)
+        self.pool.release(connection)
+        self.assertIs(self.pool.acquire(health_check=False), connection)
+
+    def test_health_check(self):
+        connection = self.pool.acquire(health_check=True)
+        self.pool.release(connection)
+        connection.cursor.side_effect = Database.OperationalError
+        replacement = self.pool.acquire(health_check=True)
+        self.assertIsNot(replacement, connection)
+        connection.close.assert_called_once()
+        self.assertEqual(self.stat('health_check_failures'), 1)
+        self.assertEqual(self.pool.stats(), {'pool_idle': 0, 'pool_in_use': 1})
+
+    def test_release(self):
+        connection = self.pool.acquire(health_check=False)
+        connection.info.transaction_status = (
+            psycopg2.extensions.TRANSACTION_STATUS_INTRANS)
+        self.pool.release(connection)
+        connection.rollback.assert_called_once()
+        self.assertIs(self.pool.acquire(health_check=False), connection)
+        connection.info.transaction_status = (
+            psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN)
+        self.pool.release(connection)
+        connection.close.assert_called_once()
+        connection = self.pool.acquire(health_check=False)
+        # Подключение, закрытое внутри транзакции, в пул не возвращается.
+        self.pool.release(connection, discard=True)
+        connection.close.assert_called_once()
+        self.assertEqual(self.pool.stats(), {'pool_idle': 0, 'pool_in_use': 0})
+
+    def test_wrapper_health_check(self):
+        wrapper = DatabaseWrapper({
+            'NAME': 'foodgram', 'USER': '', 'PASSWORD': '', 'HOST': '',
+            'PORT': '', 'OPTIONS': {}, 'TIME_ZONE': None,
+            'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True,
+        }, alias=self.alias)
+        wrapper.connection = mock.MagicMock()
+        with mock.patch.object(wrapper, 'is_usable', return_value=False):
+            with mock.patch.object(wrapper, 'close') as close:
+                # Проверка выполняется один раз за запрос к API.
+                wrapper.close_if_health_check_failed()
+                wrapper.close_if_health_check_failed()
+                close.assert_called_once()
+                # Внутри транзакции подключение не проверяется.
+                wrapper.health_check_done = False
+                wrapper.in_atomic_block = True
+                wrapper.close_if_health_check_failed()
+                close.assert_called_once()
+        self.assertEqual(self.stat('health_check_failures'), 1)
+
+    def test_max_lifetime(self):
+        self.pool.max_lifetime = 0
+        connection = self.pool.acquire(health_check=False)
+        self.pool.release(connection)
+        connection.close.assert_called_once()
+        self.assertEqual(self.pool.stats(), {'pool_idle': 0, 'pool_in_use': 0})
+
+
+class DecodeBase64ImageTest(TestCase):
+    """Декодирование картинки из data URL."""
+
+    def test_whitespace(self):
+        header, encoded = image_data_url().split(',')
+        lines = [
+            encoded[start:start + 4] for start in range(0, len(encoded), 4)]
+        expected = base64.b64decode(encoded)
+        for separator in ('\n', '\r\n', ' '):
+            with self.subTest(separator=repr(separator)):
+                with mock.patch('api.utils.BASE64_CHUNK_SIZE', 7):
+                    file = decode_base64_image(
+                        f'{header},{separator.join(lines)}{separator}')
+                self.assertEqual(file.read(), expected)
+                self.assertEqual(file.size, len(expected))
+
+    def test_rejected(self):
+        header, encoded = image_data_url().split(',')
+        gif = base64.b64encode(b'GIF89a' + bytes(20)).decode()
+        cases = {
+            'not data url': encoded,
+            'not base64': f'data:image/png,{encoded}',
+            'unsupported type': f'data:image/bmp;base64,{encoded}',
+            'empty': f'{header},',
+            'length': f'{header},{encoded}A',
+            'alphabet': f'{header},{encoded[:-4]}!!!!',
+            'non-ascii': f'{header},{encoded[:-4]}ééé=',
+            'signature': f'{header},{gif}',
+            'unicode whitespace': f'{header},{encoded[:4]}\u2003{encoded}',
+        }
+        for case, data in cases.items():
+            with self.subTest(case):
+                with mock.patch('api.utils.BASE64_CHUNK_SIZE', 7):
+                    with self.assertRaises(ValidationError):
+                        decode_base64_image(data)
+
+    def test_max_size(self):
+        data = image_data_url()
+        size = len(base64.b64decode(data.split(',')[1]))
+        with self.settings(RECIPE_IMAGE_MAX_SIZE=size):
+            self.assertEqual(decode_base64_image(data).size, size)
+        with self.settings(RECIPE_IMAGE_MAX_SIZE=size - 1):
+            with self.assertRaises(ValidationError):
+                decode_base64_image(data)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, REFERENCE_CACHE_ALIAS=None)
+class RecipeWriteQueriesTest(APITestCase):
+    """Число запросов записи рецепта не зависит от числа ингредиентов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='author', email='author@example.com')
+        cls.tags = [
+            Tag.objects.create(
+                name=f'тэг {number}', color=f'#00000{number}',
+                slug=f'tag-{number}')
+            for number in range(2)]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(20)]
+        DataVersion.objects.bump([
+            TAG_CACHE.counter.key, INGREDIENT_CACHE.counter.key])
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        TAG_CACHE.all()
+        INGREDIENT_CACHE.all()
+
+    def recipe_data(self, count, offset=0):
+        return {
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 10}
+                for ingredient in self.ingredients[offset:offset + count]],
+            'tags': [tag.pk for tag in self.tags],
+            'image': image_data_url(),
+            'name': 'суп',
+            'text': 'описание',
+            'cooking_time': 5,
+        }
+
+    def test_create(self):
+        for count in (1, 10):
+            with self.subTest(ingredients=count):
+                with self.assertNumQueries(14):
+                    response = self.client.post(
+                        '/api/recipes/', self.recipe_data(count),
+                        format='json')
+                self.assertEqual(response.status_code, 201)
+
+    def test_update(self):
+        for count in (1, 10):
+            with self.subTest(ingredients=count):
+                response = self.client.post(
+                    '/api/recipes/', self.recipe_data(count), format='json')
+                url = f'/api/recipes/{response.data["id"]}/'
+                with self.assertNumQueries(17):
+                    response = self.client.patch(
+                        url, self.recipe_data(count, offset=10),
+                        format='json')
+                self.assertEqual(response.status_code, 200)
+
+    def test_diff_update(self):
+        response = self.client.post(
+            '/api/recipes/', self.recipe_data(4), format='json')
+        recipe_id = response.data['id']
+        buyer = User.objects.create(
+            username='buyer', email='buyer@example.com')
+        self.client.force_authenticate(buyer)
+        self.client.post(f'/api/recipes/{recipe_id}/shopping_cart/')
+        rows = dict(IngredientInRecipesAmount.objects.filter(
+            recipe_id=recipe_id).values_list('ingredient_id', 'pk'))
+        first, second, removed, kept, added = [
+            ingredient.pk for ingredient in self.ingredients[:5]]
+        data = self.recipe_data(0)
+        data['ingredients'] = [
+            {'id': first, 'amount': 10},
+            {'id': second, 'amount': 25},
+            {'id': kept, 'amount': 10},
+            {'id': added, 'amount': 5}]
+        self.client.force_authenticate(self.user)
+        response = self.client.patch(
+            f'/api/recipes/{recipe_id}/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        amounts = {
+            row.ingredient_id: (row.pk, row.amount)
+            for row in IngredientInRecipesAmount.objects.filter(
+                recipe_id=recipe_id)}
+        # Строки без изменений и измененные сохраняют первичный ключ.
+        self.assertEqual(amounts[first], (rows[first], 10))
+        self.assertEqual(amounts[second], (rows[second], 25))
+        self.assertEqual(amounts[kept], (rows[kept], 10))
+        self.assertNotIn(removed, amounts)
+        self.assertEqual(amounts[added][1], 5)
+        self.assertEqual(
+            dict(ShoppingCartIngredient.objects.filter(
+                user=buyer).values_list('ingredient_id', 'amount')),
+            {first: 10, second: 25, kept: 10, added: 5})
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT, RESPONSE_CACHE_TIMEOUT=0,
+    RECIPE_IMAGE_VARIANTS={'thumbnail': 32, 'medium': 64})
+class ImageVariantsTest(APITestCase):
+    """Копии фотографий создаются из очереди задач."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='author', email='author@example.com')
+        tag = Tag.objects.create(name='тэг', color='#000000', slug='tag')
+        ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г')
+        self.data = {
+            'ingredients': [{'id': ingredient.pk, 'amount': 10}],
+            'tags': [tag.pk],
+            'image': image_data_url((128, 64)),
+            'name': 'суп',
+            'text': 'описание',
+            'cooking_time': 5,
+        }
+        self.client.force_authenticate(self.user)
+
+    def run_queue(self):
+        output = StringIO()
+        call_command('build_image_variants', stdout=output, stderr=output)
+        return output.getvalue()
+
+    def test_variants(self):
+        response = self.client.post('/api/recipes/', self.data, format='json')
+        recipe_id = response.data['id']
+        response = self.client.get(f'/api/recipes/{recipe_id}/')
+        self.assertEqual(response.data['image_variants'], {})
+        self.assertTrue(
+            ImageVariantsTask.objects.filter(recipe_id=recipe_id).exists())
+        self.assertIn('Обработано: 1, ошибок: 0', self.run_queue())
+        self.assertFalse(ImageVariantsTask.objects.exists())
+        recipe = Recipe.objects.get(pk=recipe_id)
+        self.assertEqual(recipe.image_variants['source'], recipe.image.name)
+        for variant, size in (('thumbnail', 32), ('medium', 64)):
+            for path in recipe.image_variants[variant].values():
+                with default_storage.open(path) as file:
+                    with Image.open(file) as image:
+                        self.assertEqual(image.size, (size, size // 2))
+        response = self.client.get(f'/api/recipes/{recipe_id}/')
+        self.assertEqual(
+            set(response.data['image_variants']), {'thumbnail', 'medium'})
+        # Прежние копии удаляются после создания копий новой фотографии.
+        old_files = variant_files(recipe.image_variants)
+        self.client.patch(
+            f'/api/recipes/{recipe_id}/', self.data, format='json')
+        self.run_queue()
+        for path in old_files:
+            self.assertFalse(default_storage.exists(path))
+        recipe.refresh_from_db()
+        for path in variant_files(recipe.image_variants):
+            self.assertTrue(default_storage.exists(path))
+
+    def test_failure(self):
+        response = self.client.post('/api/recipes/', self.data, format='json')
+        recipe_id = response.data['id']
+        Recipe.objects.filter(pk=recipe_id).update(
+            image='recipes/missing.png')
+        task = ImageVariantsTask.objects.get()
+        # Задача с ошибкой переносится в конец очереди, а проход
+        # по очереди завершается.
+        self.assertIn('Обработано: 0, ошибок: 1', self.run_queue())
+        self.assertGreater(
+            ImageVariantsTask.objects.get().created, task.created)
+        self.assertIsNone(run_next_task(task.created))
+
+
+class ShoppingCartDownloadTest(APITestCase):
+    """Список покупок без сводной таблицы пересчитывается по корзине."""
+
+    def test_without_aggregate(self):
+        user = User.objects.create(
+            username='buyer', email='buyer@example.com')
+        ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г')
+        for number in range(2):
+            recipe = Recipe.objects.create(
+                author=user, name=f'рецепт {number}',
+                image='recipes/image.png', text='описание', cooking_time=1)
+            IngredientInRecipesAmount.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=150)
+            ShoppingCart.objects.create(user=user, recipe=recipe)
+        self.client.force_authenticate(user)
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'format': 'txt'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'мука - 300 (г)', b''.join(response.streaming_content).decode())
+        self.assertEqual(
+            ShoppingCartIngredient.objects.get(user=user).amount, 300)
+
+    def test_pdf(self):
+        user = User.objects.create(
+            username='buyer', email='buyer@example.com')
+        ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г')
+        recipe = Recipe.objects.create(
+            author=user, name='рецепт', image='recipes/image.png',
+            text='описание', cooking_time=1)
+        IngredientInRecipesAmount.objects.create(
+            recipe=recipe, ingredient=ingredient, amount=150)
+        ShoppingCart.objects.create(user=user, recipe=recipe)
+        self.client.force_authenticate(user)
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'format': 'pdf'})
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(b'%PDF-1.4'))
+        self.assertTrue(content.endswith(b'%%EOF\n'))
+        self.assertIn(pdf_string('мука - 150 (г)') + b' Tj', content)
+
+
+@override_settings(
+    DATABASE_REPLICAS=[REPLICA_ALIAS],
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_ROOT},
+    },
+    REFERENCE_CACHE_ALIAS='shared',
+    RESPONSE_CACHE_TIMEOUT=0)
+class ReplicaRoutingTest(TransactionTestCase):
+    """Чтение с реплики, запись и чтение после записи - с основной базы."""
+
+    databases = {'default', REPLICA_ALIAS}
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(CACHE_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # Одинаковые рецепты с разными названиями в основной базе и реплике.
+        for alias in ('default', REPLICA_ALIAS):
+            author = User.objects.using(alias).create(
+                username='author', email='author@example.com')
+            self.recipe = Recipe.objects.using(alias).create(
+                author=author, name=alias, image='recipes/image.png',
+                text='описание', cooking_time=1)
+        self.token = Token.objects.create(user=author)
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def tearDown(self):
+        # Таблицы реплики очистка после теста не трогает, см. allow_migrate.
+        User.objects.using(REPLICA_ALIAS).all().delete()
+
+    def test_routing(self):
+        headers = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+        self.assertEqual(self.client.get(self.url).json()['name'],
+                         REPLICA_ALIAS)
+        response = self.client.post(f'{self.url}favorite/', **headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(FavoriteReceipe.objects.using('default').exists())
+        self.assertFalse(
+            FavoriteReceipe.objects.using(REPLICA_ALIAS).exists())
+        # Автор своей записи читает с основной базы, остальные - с реплики.
+        self.assertEqual(
+            self.client.get(self.url, **headers).json()['name'], 'default')
+        self.assertEqual(self.client.get(self.url).json()['name'],
+                         REPLICA_ALIAS)
+
+    @override_settings(REFERENCE_CACHE_ALIAS=None)
+    def test_without_shared_cache(self):
+        self.assertEqual(
+            self.client.get(self.url).json()['name'], 'default')
+
+
+class MetricsAccessTest(TestCase):
+    """Метрики доступны только по токену или с разрешенных адресов."""
+
+    @override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=[])
+    def test_closed_by_default(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    @override_settings(METRICS_TOKEN='secret', METRICS_ALLOWED_IPS=[])
+    def test_token(self):
+        response = self.client.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_allowed_ip(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(REFERENCE_CACHE_ALIAS=None)
+class SharedVersionsTest(APITestCase):
+    """Кэши процесса сбрасываются версией, увеличенной другим процессом."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_reference_cache(self):
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response.data, [])
+        Tag.objects.create(name='завтрак', color='#000000', slug='breakfast')
+        DataVersion.objects.bump([TAG_CACHE.counter.key])
+        response = self.client.get('/api/tags/')
+        self.assertEqual(
+            [tag['slug'] for tag in response.data], ['breakfast'])
+
+    def test_response_cache(self):
+        author = User.objects.create(
+            username='author', email='author@example.com')
+        recipe = Recipe.objects.create(
+            author=author, name='суп', image='recipes/image.png',
+            text='описание', cooking_time=1)
+        url = f'/api/recipes/{recipe.pk}/'
+        self.assertEqual(self.client.get(url).json()['name'], 'суп')
+        Recipe.objects.filter(pk=recipe.pk).update(name='борщ')
+        self.assertEqual(self.client.get(url).json()['name'], 'суп')
+        DataVersion.objects.stamp(
+            [RESPONSE_CACHE.version_key(f'recipe:{recipe.pk}')],
+            time.time_ns())
+        self.assertEqual(self.client.get(url).json()['name'], 'борщ')
+
+    def test_versions_once_per_request(self):
+        with request_versions():
+            TAG_CACHE.all()
+            DataVersion.objects.bump([TAG_CACHE.counter.key])
+            with self.assertNumQueries(0):
+                TAG_CACHE.all()
+                TAG_CACHE.all()
+            Tag.objects.create(name='обед', color='#000001', slug='lunch')
+            TAG_CACHE.bump()
+            self.assertEqual(
+                [tag.slug for tag in TAG_CACHE.all()], ['lunch'])
+
+    def test_change_during_build(self):
+        started = time.time_ns()
+        RESPONSE_CACHE.bump(['recipe:1'])
+        self.assertIsNone(RESPONSE_CACHE.set(
+            'changed', b'[]', 'application/json', {'recipe:1', 'all'},
+            started))
+        self.assertIsNotNone(RESPONSE_CACHE.set(
+            'unrelated', b'[]', 'application/json', {'recipe:2', 'all'},
+            started))
+
+    def test_one_bump_per_transaction(self):
+        author = User.objects.create(
+            username='author', email='author@example.com')
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(5)]
+        with mock.patch(
+                'recipes.response_cache.stamp_versions') as stamp_versions:
+            with self.captureOnCommitCallbacks(execute=True):
+                recipe = Recipe.objects.create(
+                    author=author, name='суп', image='recipes/image.png',
+                    text='описание', cooking_time=1)
+                for ingredient in ingredients:
+                    IngredientInRecipesAmount.objects.create(
+                        recipe=recipe, ingredient=ingredient, amount=1)
+        stamp_versions.assert_called_once()
+
+
+class RecipeIngredientIndexTest(TestCase):
+    """Изменения рецептов применяются к индексу из журнала."""
+
+    def test_changes(self):
+        author = User.objects.create(
+            username='author', email='author@example.com')
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(3)]
+        recipes = [
+            Recipe.objects.create(
+                author=author, name=f'рецепт {number}',
+                image='recipes/image.png', text='описание', cooking_time=1)
+            for number in range(3)]
+        recipe_ids = [recipe.pk for recipe in recipes]
+        with self.captureOnCommitCallbacks(execute=True):
+            for recipe in recipes:
+                for ingredient in ingredients[:2]:
+                    IngredientInRecipesAmount.objects.create(
+                        recipe=recipe, ingredient=ingredient, amount=1)
+        index = RecipeIngredientIndex()
+        index.load()
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientInRecipesAmount.objects.filter(
+                recipe=recipes[0], ingredient=ingredients[0]).delete()
+            IngredientInRecipesAmount.objects.create(
+                recipe=recipes[0], ingredient=ingredients[2], amount=1)
+            recipes[1].delete()
+        self.assertEqual(
+            RecipeIngredientChange.objects.filter(
+                version__gt=index.version).values('version').distinct()
+            .count(), 1)
+        with mock.patch.object(index, 'build') as build:
+            index.load()
+        build.assert_not_called()
+        rebuilt = RecipeIngredientIndex()
+        rebuilt.load()
+        for ingredient_ids in ([ingredients[0].pk], [ingredients[1].pk],
+                               [ingredients[1].pk, ingredients[2].pk]):
+            self.assertEqual(
+                index.search(ingredient_ids),
+                rebuilt.search(ingredient_ids))
+        self.assertEqual(
+            [index.counts[recipe_id] for recipe_id in recipe_ids], [2, 0, 2])
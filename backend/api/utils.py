@@ -1,20 +1,373 @@
-from django.shortcuts import HttpResponse
-
-
-def shopping_cart_file(ingredients):
-    """Загрузка списка покупок с ингредиентами в формате .txt."""
-
-    shopping_list = 'Список покупок: \n'
-    for ingredient in ingredients:
-        shopping_list += (
-            f'{ingredient["ingredient__name"]} - '
-            f'{ingredient["amount_sum"]} '
-            f'({ingredient["ingredient__measurement_unit"]}) \n'
-        )
-        response = HttpResponse(
-            shopping_list, content_type='text/plain; charset=utf8'
-        )
-        response[
-            'Content-Disposition'
-        ] = 'attachment; filename="shopping_cart.txt"'
+import csv
+import json
+import textwrap
+from abc import ABC, abstractmethod
+from base64 import b64decode
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import BaseRenderer
+
+BASE64_CHUNK_SIZE = 64 * 1024
+BASE64_WHITESPACE = ' \t\n\r\f\v'
+WITHOUT_WHITESPACE = str.maketrans('', '', BASE64_WHITESPACE)
+DATA_URL_HEADER_MAX_LENGTH = 64
+# Сколько первых байтов файла нужно для проверки сигнатуры.
+SIGNATURE_SIZE = 16
+
+# Страница A4 в пунктах.
+PDF_PAGE_SIZE = (595, 842)
+PDF_MARGIN = 50
+PDF_FONT_SIZE = 12
+PDF_LINE_HEIGHT = 16
+# Ширина строки в символах с запасом на широкие буквы.
+PDF_LINE_LENGTH = int(
+    (PDF_PAGE_SIZE[0] - 2 * PDF_MARGIN) / (PDF_FONT_SIZE * 0.6))
+# Символы вне ASCII получают коды от 128 в кодировке шрифта Helvetica.
+PDF_CHARACTERS = [chr(code) for code in range(0x410, 0x450)] + [
+    'Ё', 'ё', '№', '«', '»', '—']
+PDF_CODES = {
+    character: 128 + index
+    for index, character in enumerate(PDF_CHARACTERS)}
+
+IMAGE_SIGNATURES = {
+    'image/jpeg': ('jpg', lambda head: head.startswith(b'\xff\xd8\xff')),
+    'image/png': ('png', lambda head: head.startswith(b'\x89PNG\r\n\x1a\n')),
+    'image/gif': ('gif', lambda head: head[:6] in (b'GIF87a', b'GIF89a')),
+    'image/webp': (
+        'webp', lambda head: head[:4] == b'RIFF' and head[8:12] == b'WEBP'),
+}
+
+
+def parse_data_url(data):
+    """Тип картинки из заголовка data URL и начало данных base64."""
+
+    separator = data.find(',', 0, DATA_URL_HEADER_MAX_LENGTH)
+    header = data[:separator]
+    if separator < 0 or not header.endswith(';base64'):
+        raise ValidationError('Картинка должна быть передана в base64')
+    content_type = header[len('data:'):-len(';base64')]
+    if content_type not in IMAGE_SIGNATURES:
+        raise ValidationError(f'Неподдерживаемый тип картинки {content_type}')
+    return content_type, separator + 1
+
+
+def decode_base64_size(data, start):
+    """Размер данных base64 из data[start:] после декодирования."""
+
+    # Пробелы и переводы строк допустимы и в размер не входят.
+    encoded_size = len(data) - start - sum(
+        data.count(character, start) for character in BASE64_WHITESPACE)
+    tail = data[max(start, len(data) - 64):].translate(WITHOUT_WHITESPACE)
+    size = encoded_size // 4 * 3 - tail[-2:].count('=')
+    if encoded_size % 4 or size <= 0:
+        raise ValidationError('Некорректные данные base64')
+    return size
+
+
+def decode_base64_chunks(data, start):
+    """
+    Декодирование base64 из data[start:] частями.
+
+    Пробелы и переводы строк пропускаются; остаток части, не кратный 4
+    символам, декодируется вместе со следующей.
+    """
+
+    rest = ''
+    for offset in range(start, len(data), BASE64_CHUNK_SIZE):
+        encoded = rest + data[offset:offset + BASE64_CHUNK_SIZE].translate(
+            WITHOUT_WHITESPACE)
+        aligned = len(encoded) - len(encoded) % 4
+        rest = encoded[aligned:]
+        try:
+            yield b64decode(encoded[:aligned], validate=True)
+        except ValueError:
+            raise ValidationError('Некорректные данные base64')
+
+
+def decode_base64_image(data):
+    """
+    Декодирование картинки из data URL частями.
+
+    Тип из заголовка и сигнатура файла проверяются по первым байтам,
+    размер - по длине строки до декодирования. Небольшие файлы
+    собираются в памяти, остальные - во временном файле на диске.
+    """
+
+    content_type, start = parse_data_url(data)
+    extension, check_signature = IMAGE_SIGNATURES[content_type]
+    size = decode_base64_size(data, start)
+    if size > settings.RECIPE_IMAGE_MAX_SIZE:
+        raise ValidationError(
+            'Размер картинки не должен превышать '
+            f'{settings.RECIPE_IMAGE_MAX_SIZE // (1024 * 1024)} МБ')
+    name = f'temp.{extension}'
+    if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+        file = TemporaryUploadedFile(name, content_type, size, None)
+    else:
+        file = InMemoryUploadedFile(
+            BytesIO(), None, name, content_type, size, None)
+    head = b''
+    try:
+        for chunk in decode_base64_chunks(data, start):
+            if len(head) < SIGNATURE_SIZE:
+                head += chunk[:SIGNATURE_SIZE - len(head)]
+                if len(head) == SIGNATURE_SIZE and not check_signature(head):
+                    break
+            file.write(chunk)
+    except ValidationError:
+        file.close()
+        raise
+    if not check_signature(head):
+        file.close()
+        raise ValidationError('Содержимое картинки не соответствует ее типу')
+    file.seek(0)
+    return file
+
+
+class ShoppingCartRenderer(ABC, BaseRenderer):
+    """Базовый формат выгрузки списка покупок."""
+
+    charset = 'utf-8'
+
+    @abstractmethod
+    def stream(self, ingredients):
+        """Построчная выгрузка ингредиентов."""
+
+    def stream_bytes(self, ingredients):
+        """Содержимое файла частями в байтах."""
+
+        for line in self.stream(ingredients):
+            yield line.encode(self.charset)
+
+    @property
+    def content_type(self):
+        if self.charset is None:
+            return self.media_type
+        return f'{self.media_type}; charset={self.charset}'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Ответы с ошибками отдаются в JSON."""
+
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    """Выгрузка списка покупок в формате .txt."""
+
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        yield 'Список покупок: \n'
+        for ingredient in ingredients:
+            yield (
+                f'{ingredient["ingredient__name"]} - '
+                f'{ingredient["amount_sum"]} '
+                f'({ingredient["ingredient__measurement_unit"]}) \n'
+            )
+
+
+class Echo:
+    """Псевдо-файл, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    """Выгрузка списка покупок в формате .csv."""
+
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(
+            ('ингредиент', 'количество', 'единица измерения'))
+        for ingredient in ingredients:
+            yield writer.writerow((
+                ingredient['ingredient__name'],
+                ingredient['amount_sum'],
+                ingredient['ingredient__measurement_unit'],))
+
+
+class ShoppingCartJSONRenderer(ShoppingCartRenderer):
+    """Выгрузка списка покупок в формате .json."""
+
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, ingredients):
+        separator = '['
+        for ingredient in ingredients:
+            yield separator + json.dumps({
+                'name': ingredient['ingredient__name'],
+                'amount': ingredient['amount_sum'],
+                'measurement_unit': ingredient[
+                    'ingredient__measurement_unit'],
+            }, ensure_ascii=False)
+            separator = ','
+        yield '[]' if separator == '[' else ']'
+
+
+def pdf_string(text):
+    """Строка PDF в кодировке шрифта; прочие символы заменяются на ?."""
+
+    data = bytearray()
+    for character in text:
+        if character in PDF_CODES:
+            data.append(PDF_CODES[character])
+            continue
+        if not ' ' <= character <= '~':
+            character = '?'
+        elif character in '()\\':
+            data.append(ord('\\'))
+        data.append(ord(character))
+    return b'(' + bytes(data) + b')'
+
+
+def pdf_to_unicode():
+    """CMap для копирования и поиска текста в PDF."""
+
+    characters = ''.join(
+        f'<{code:02X}> <{ord(character):04X}>\n'
+        for character, code in PDF_CODES.items())
+    return (
+        '/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n'
+        '/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) '
+        '/Supplement 0 >> def\n'
+        '/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n'
+        '1 begincodespacerange\n<00> <FF>\nendcodespacerange\n'
+        '1 beginbfrange\n<20> <7E> <0020>\nendbfrange\n'
+        f'{len(PDF_CODES)} beginbfchar\n{characters}endbfchar\n'
+        'endcmap\nCMapName currentdict /CMap defineresource pop\n'
+        'end\nend\n').encode('ascii')
+
+
+class PDFWriter:
+    """Объекты PDF по одному с учетом смещений для таблицы xref."""
+
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+
+    def write(self, data):
+        self.offset += len(data)
+        return data
+
+    def header(self):
+        return self.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def object(self, number, body):
+        self.offsets[number] = self.offset
+        return self.write(
+            f'{number} 0 obj\n'.encode('ascii') + body + b'\nendobj\n')
+
+    def stream(self, number, data):
+        return self.object(
+            number, f'<< /Length {len(data)} >>\nstream\n'.encode('ascii')
+            + data + b'\nendstream')
+
+    def trailer(self, root, info):
+        size = max(self.offsets) + 1
+        entries = ''.join(
+            f'{self.offsets[number]:010d} 00000 n \n'
+            for number in range(1, size))
+        return self.write((
+            f'xref\n0 {size}\n0000000000 65535 f \n{entries}'
+            f'trailer\n<< /Size {size} /Root {root} 0 R '
+            f'/Info {info} 0 R >>\n'
+            f'startxref\n{self.offset}\n%%EOF\n').encode('ascii'))
+
+
+class ShoppingCartPDFRenderer(ShoppingCartTextRenderer):
+    """
+    Выгрузка списка покупок в формате .pdf.
+
+    Строки те же, что и в .txt. Текст набирается стандартным шрифтом
+    Helvetica без встраивания, кириллица задается кодировкой шрифта.
+    Страницы отдаются по мере заполнения, в памяти только текущая.
+    """
+
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    def pages(self, ingredients):
+        """Строки, разбитые на страницы."""
+
+        per_page = (
+            (PDF_PAGE_SIZE[1] - 2 * PDF_MARGIN) // PDF_LINE_HEIGHT)
+        page = []
+        for text in self.stream(ingredients):
+            for line in textwrap.wrap(text, PDF_LINE_LENGTH) or ['']:
+                if len(page) == per_page:
+                    yield page
+                    page = []
+                page.append(line)
+        yield page
+
+    @staticmethod
+    def page_content(lines):
+        top = PDF_PAGE_SIZE[1] - PDF_MARGIN - PDF_FONT_SIZE
+        content = [
+            f'BT /F1 {PDF_FONT_SIZE} Tf {PDF_LINE_HEIGHT} TL '
+            f'{PDF_MARGIN} {top} Td'.encode('ascii')]
+        content.extend(pdf_string(line) + b' Tj T*' for line in lines)
+        content.append(b'ET')
+        return b'\n'.join(content)
+
+    def stream_bytes(self, ingredients):
+        writer = PDFWriter()
+        yield writer.header()
+        yield writer.object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        differences = ' '.join(
+            f'/uni{ord(character):04X}' for character in PDF_CHARACTERS)
+        yield writer.object(3, (
+            '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+            '/Encoding << /Type /Encoding /BaseEncoding /WinAnsiEncoding '
+            f'/Differences [128 {differences}] >> /ToUnicode 4 0 R >>'
+        ).encode('ascii'))
+        yield writer.stream(4, pdf_to_unicode())
+        title = 'Список покупок'.encode('utf-16-be').hex().upper()
+        yield writer.object(5, f'<< /Title <FEFF{title}> >>'.encode('ascii'))
+        kids = []
+        for lines in self.pages(ingredients):
+            number = 6 + 2 * len(kids)
+            yield writer.stream(number, self.page_content(lines))
+            yield writer.object(number + 1, (
+                '<< /Type /Page /Parent 2 0 R '
+                '/Resources << /Font << /F1 3 0 R >> >> '
+                f'/Contents {number} 0 R >>').encode('ascii'))
+            kids.append(f'{number + 1} 0 R')
+        yield writer.object(2, (
+            f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} '
+            f'/MediaBox [0 0 {PDF_PAGE_SIZE[0]} {PDF_PAGE_SIZE[1]}] >>'
+        ).encode('ascii'))
+        yield writer.trailer(root=1, info=5)
+
+
+SHOPPING_CART_RENDERERS = [
+    ShoppingCartTextRenderer,
+    ShoppingCartCSVRenderer,
+    ShoppingCartJSONRenderer,
+    ShoppingCartPDFRenderer,
+]
+
+
+def shopping_cart_file(ingredients, renderer):
+    """Потоковая загрузка списка покупок в выбранном формате."""
+
+    response = StreamingHttpResponse(
+        renderer.stream_bytes(ingredients.iterator()),
+        content_type=renderer.content_type
+    )
+    response[
+        'Content-Disposition'
+    ] = f'attachment; filename="shopping_cart.{renderer.format}"'
     return response
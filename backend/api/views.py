@@ -1,39 +1,47 @@
-from django.db.models import Sum
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Prefetch, prefetch_related_objects
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from recipes.models import (FavoriteReceipe, Ingredient,
-                            IngredientInRecipesAmount, Recipe, ShoppingCart,
-                            Tag)
+from recipes.cache import INGREDIENT_CACHE, TAG_CACHE
+from recipes.feed import backfill, get_feed, prune, trim_timeline
+from recipes.models import (FavoriteReceipe, Ingredient, Recipe, ShoppingCart,
+                            ShoppingCartIngredient, Tag)
+from recipes.search import RECIPE_INGREDIENT_INDEX
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
 from rest_framework.response import Response
 from users.models import Follow, User
 
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import LimitPaginator
+from .mixins import AnonymousResponseCacheMixin, ReferenceCacheMixin
+from .pagination import FeedCursorPaginator, LimitPaginator, RecipePaginator
 from .permissions import OwnerOrReadOnly
 from .serializers import (FollowSerializer, IngredientSerializer,
-                          RecipesReadSerializer, RecipesWriteSerializer,
+                          RecipesFastReadSerializer, RecipesReadSerializer,
+                          RecipesWriteSerializer,
                           ShoppingListFavoiriteSerializer, TagSerializer,
-                          UserSerializer)
-from .utils import shopping_cart_file
+                          UserSerializer, get_recipes_limit)
+from .utils import SHOPPING_CART_RENDERERS, shopping_cart_file
 
 
-class TagsViewSet(viewsets.ModelViewSet):
+class TagsViewSet(ReferenceCacheMixin, viewsets.ModelViewSet):
     """Класс взаимодействия с моделью Tags. Вьюсет для списка тегов."""
 
     queryset = Tag.objects.all()
+    reference_cache = TAG_CACHE
     serializer_class = TagSerializer
 
 
-class IngredientsViewSet(viewsets.ModelViewSet):
+class IngredientsViewSet(ReferenceCacheMixin, viewsets.ModelViewSet):
     """Класс взаимодействия с Ingredients. Вьюсет для ингредиентов."""
     queryset = Ingredient.objects.all()
+    reference_cache = INGREDIENT_CACHE
     serializer_class = IngredientSerializer
     filter_backends = [IngredientFilter]
-    search_fields = ('^name', )
 
 
 class UsersViewSet(UserViewSet):
@@ -42,6 +50,12 @@ class UsersViewSet(UserViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            return queryset.add_subscribed(self.request.user)
+        return queryset
+
     @action(
         detail=False,
         methods=['GET'],
@@ -50,48 +64,123 @@ class UsersViewSet(UserViewSet):
         serializer = self.get_serializer(request.user)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    def add_recipes(self, authors):
+        """Последние рецепты авторов, не больше recipes_limit у каждого."""
+
+        recipes = Recipe.objects.order_by('-pub_date', '-id')
+        recipes_limit = get_recipes_limit(self.request)
+        if recipes_limit is not None:
+            recipes = recipes.latest_by_author(
+                [author.pk for author in authors], recipes_limit)
+        prefetch_related_objects(authors, Prefetch(
+            'recipes', queryset=recipes, to_attr='limited_recipes'))
+        return authors
+
     @action(
         methods=['GET'], detail=False,
         permission_classes=(IsAuthenticated,),
         pagination_class=LimitPaginator,)
     def subscriptions(self, request):
         user = self.request.user
-        queryset = Follow.objects.filter(user=user)
-        page = self.paginate_queryset(queryset)
+        queryset = User.objects.add_subscribed(user).filter(
+            following__user=user).order_by('following__id')
+        page = self.add_recipes(self.paginate_queryset(queryset))
         serializer = FollowSerializer(
             page, many=True, context={'request': request})
         return self.get_paginated_response(serializer.data)
 
+    @action(
+        methods=['GET'], detail=False,
+        permission_classes=(IsAuthenticated,),
+        pagination_class=FeedCursorPaginator,)
+    def feed(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь."""
+
+        user = request.user
+        paginator = self.paginator
+        positions = paginator.paginate_positions(
+            lambda position, size: get_feed(user, position, size), request)
+        if paginator.position is None:
+            trim_timeline(user)
+        recipes = Recipe.objects.for_read(user).in_bulk(
+            [recipe_id for _, recipe_id in positions])
+        serializer = RecipesReadSerializer(
+            [recipes[recipe_id] for _, recipe_id in positions
+             if recipe_id in recipes],
+            many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
     @action(
         methods=['POST', 'DELETE'], detail=True,
         permission_classes=(IsAuthenticated,),)
+    @transaction.atomic
     def subscribe(self, request, id):
         user = request.user
         author = get_object_or_404(User, id=id)
+        authors = User.objects.filter(pk=author.pk)
         if request.method == 'POST':
+            Follow.objects.create(user=user, author=author)
+            authors.change_counter('followers_count', 1)
+            backfill(user, author)
+            author = User.objects.add_subscribed(user).get(pk=author.pk)
+            self.add_recipes([author])
             serializer = FollowSerializer(
-                Follow.objects.create(user=user, author=author),
-                context={'request': request},)
+                author, context={'request': request},)
             return Response(
                 serializer.data, status=status.HTTP_201_CREATED)
-        Follow.objects.filter(user=user, author=author).delete()
+        deleted, _ = Follow.objects.filter(user=user, author=author).delete()
+        if deleted:
+            authors.change_counter('followers_count', -1)
+            prune(user, author)
         return Response('Успешная отписка', status=status.HTTP_204_NO_CONTENT)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AnonymousResponseCacheMixin, viewsets.ModelViewSet):
     """Класс взаимодействия с моделью Recipes. Вьюсет для рецептов."""
 
     queryset = Recipe.objects.all()
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
     permission_class = (OwnerOrReadOnly,)
-    pagination_class = LimitPaginator
+    pagination_class = RecipePaginator
+    counter_fields = {
+        FavoriteReceipe: 'favorites_count',
+        ShoppingCart: 'shopping_cart_count',
+    }
+
+    def get_queryset(self):
+        if self.request.method in SAFE_METHODS:
+            return Recipe.objects.for_read(self.request.user)
+        return Recipe.objects.all()
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
+            if settings.RECIPE_FAST_SERIALIZER:
+                return RecipesFastReadSerializer
             return RecipesReadSerializer
         return RecipesWriteSerializer
 
+    @transaction.atomic
+    def perform_create(self, serializer):
+        recipe = serializer.save()
+        User.objects.filter(pk=self.request.user.pk).change_counter(
+            'recipes_count', 1)
+        RECIPE_INGREDIENT_INDEX.schedule_update(recipe.pk)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        recipe = serializer.save()
+        RECIPE_INGREDIENT_INDEX.schedule_update(recipe.pk)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        ShoppingCartIngredient.objects.remove_recipe(
+            instance.shopping_recipes.values_list('user_id', flat=True),
+            instance)
+        User.objects.filter(pk=instance.author_id).change_counter(
+            'recipes_count', -1)
+        instance.delete()
+
     def post_delete_recipe(self, request, pk, model):
         recipe = get_object_or_404(Recipe, pk=pk)
         user = self.request.user
@@ -108,6 +197,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 model.objects.create(
                     user=user, recipe=recipe
                 )
+                Recipe.objects.filter(pk=recipe.pk).change_counter(
+                    self.counter_fields[model], 1)
                 return Response(
                     serializer.data,
                     status=status.HTTP_201_CREATED)
@@ -118,6 +209,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 model.objects.get(
                     user=user, recipe=recipe
                 ).delete()
+                Recipe.objects.filter(pk=recipe.pk).change_counter(
+                    self.counter_fields[model], -1)
                 return Response(status=status.HTTP_204_NO_CONTENT)
             else:
                 return Response(
@@ -126,24 +219,92 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @action(methods=['POST', 'DELETE'], detail=True,
             permission_class=(IsAuthenticated,),)
+    @transaction.atomic
     def favorite(self, request, **kwargs):
         return self.post_delete_recipe(
             request, kwargs.pop('pk'), FavoriteReceipe)
 
     @action(methods=['POST', 'DELETE'], detail=True,)
+    @transaction.atomic
     def shopping_cart(self, request, **kwargs):
-        return self.post_delete_recipe(
-            request, kwargs.pop('pk'), ShoppingCart)
+        pk = kwargs.pop('pk')
+        response = self.post_delete_recipe(request, pk, ShoppingCart)
+        recipe = Recipe(pk=pk)
+        if response.status_code == status.HTTP_201_CREATED:
+            ShoppingCartIngredient.objects.add_recipe(
+                [request.user.id], recipe)
+        elif response.status_code == status.HTTP_204_NO_CONTENT:
+            ShoppingCartIngredient.objects.remove_recipe(
+                [request.user.id], recipe)
+        return response
+
+    @action(methods=['GET'], detail=False, pagination_class=LimitPaginator)
+    def search_by_ingredients(self, request):
+        """
+        Рецепты, в которых есть больше всего ингредиентов из запроса.
+
+        Параметр ingredients - id ингредиентов, all=1 оставляет только
+        рецепты со всеми указанными ингредиентами.
+        """
+
+        try:
+            ingredient_ids = [
+                int(pk)
+                for value in request.query_params.getlist('ingredients')
+                for pk in value.split(',')]
+        except ValueError:
+            raise ValidationError(
+                {'ingredients': 'id ингредиентов должны быть числами'})
+        if not ingredient_ids:
+            raise ValidationError({'ingredients': 'Укажите ингредиенты'})
+        recipe_ids = RECIPE_INGREDIENT_INDEX.search(
+            ingredient_ids,
+            require_all=request.query_params.get('all') in ('1', 'true'),
+            limit=settings.RECIPE_SEARCH_LIMIT)
+        page = self.paginate_queryset(recipe_ids)
+        paginated = page is not None
+        if not paginated:
+            page = recipe_ids[:settings.RECIPES_PAGE_SIZE]
+        recipes = Recipe.objects.for_read(request.user).in_bulk(page)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in page if pk in recipes], many=True)
+        if paginated:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    @action(methods=['GET'], detail=False, pagination_class=LimitPaginator)
+    def trending(self, request):
+        """
+        Рецепты по рейтингу популярности.
+
+        Рейтинг заранее рассчитывается командой refresh_trending; без
+        параметра limit отдается первая страница. Курсорная пагинация
+        идет по дате и не сохраняет порядок рейтинга, поэтому здесь
+        страницы только по номеру.
+        """
+
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            trend__isnull=False).order_by('-trend__score', '-id')
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(
+            queryset[:settings.RECIPES_PAGE_SIZE], many=True)
+        return Response(serializer.data)
 
     @action(methods=['GET'], detail=False,
-            permission_class=(IsAuthenticated,))
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=SHOPPING_CART_RENDERERS)
     def download_shopping_cart(self, request):
-        ingredients = IngredientInRecipesAmount.objects.select_related(
-            'recipe', 'ingredient')
-        ingredients = ingredients.filter(
-            recipe__shopping_recipes__user=request.user)
+        ingredients = ShoppingCartIngredient.objects.filter(
+            user=request.user)
+        if (not ingredients.exists() and ShoppingCart.objects.filter(
+                user=request.user).exists()):
+            # Корзина есть, а сводного списка нет: он пересчитывается.
+            ShoppingCartIngredient.objects.rebuild([request.user.pk])
         ingredients = ingredients.values(
-            'ingredient__name', 'ingredient__measurement_unit')
-        ingredients = ingredients.annotate(amount_sum=Sum('amount'))
-        ingredients = ingredients.order_by('ingredient__name')
-        return shopping_cart_file(ingredients)
+            'ingredient__name', 'ingredient__measurement_unit',
+            amount_sum=F('amount'),
+        ).order_by('ingredient__name')
+        return shopping_cart_file(ingredients, request.accepted_renderer)
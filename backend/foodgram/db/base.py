@@ -0,0 +1,225 @@
+import os
+from collections import Counter, deque
+from threading import BoundedSemaphore, Lock
+from time import monotonic, perf_counter
+
+import psycopg2.extensions
+import psycopg2.extras
+from django.db.backends.postgresql import base
+
+Database = base.Database
+
+_pools = {}
+_pools_lock = Lock()
+_stats = Counter()
+_stats_lock = Lock()
+
+
+def increment(alias, name, value=1):
+    with _stats_lock:
+        _stats[alias, name] += value
+
+
+class ConnectionPool:
+    """
+    Пул подключений процесса, общий для всех потоков.
+
+    Одновременно выдается не больше max_size подключений; поток, не
+    дождавшийся подключения за timeout секунд, получает OperationalError.
+    Подключения старше max_lifetime секунд закрываются при возврате.
+    """
+
+    def __init__(self, alias, connect, max_size, timeout, max_lifetime):
+        self.alias = alias
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.slots = BoundedSemaphore(max_size)
+        self.lock = Lock()
+        self.idle = deque()
+        self.created = {}
+
+    def acquire(self, health_check):
+        if not self.slots.acquire(timeout=self.timeout):
+            increment(self.alias, 'pool_timeouts')
+            raise Database.OperationalError(
+                f'Нет свободного подключения к базе за {self.timeout} с')
+        try:
+            while True:
+                with self.lock:
+                    if not self.idle:
+                        break
+                    # Последним возвращенным подключениям реже нужна
+                    # повторная проверка на стороне сервера.
+                    connection = self.idle.pop()
+                if not health_check or self.is_usable(connection):
+                    increment(self.alias, 'pool_reused')
+                    return connection
+                increment(self.alias, 'health_check_failures')
+                self.discard(connection)
+            connection = self.connect()
+            with self.lock:
+                self.created[id(connection)] = monotonic()
+            return connection
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, connection, discard=False):
+        with self.lock:
+            created = self.created.get(id(connection))
+        if created is None:
+            # Подключение открыто до включения пула.
+            connection.close()
+            return
+        try:
+            if (discard or connection.closed
+                    or monotonic() - created > self.max_lifetime):
+                self.discard(connection)
+                return
+            status = connection.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                self.discard(connection)
+                return
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            with self.lock:
+                self.idle.append(connection)
+        except Database.Error:
+            self.discard(connection)
+        finally:
+            self.slots.release()
+
+    def discard(self, connection):
+        with self.lock:
+            self.created.pop(id(connection), None)
+        increment(self.alias, 'closed')
+        try:
+            connection.close()
+        except Database.Error:
+            pass
+
+    @staticmethod
+    def is_usable(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except Database.Error:
+            return False
+        return True
+
+    def stats(self):
+        with self.lock:
+            idle = len(self.idle)
+            total = len(self.created)
+        return {'pool_idle': idle, 'pool_in_use': total - idle}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL с проверкой постоянных подключений и пулом.
+
+    CONN_HEALTH_CHECKS: постоянное подключение проверяется перед первым
+    запросом очередного запроса к API, как в Django 4.1.
+    POOL_MAX_SIZE > 0 включает пул процесса: подключение берется из пула
+    при первом обращении к базе и возвращается в конце запроса к API,
+    CONN_MAX_AGE при этом не действует. Параметры пула: POOL_TIMEOUT и
+    POOL_MAX_LIFETIME в секундах.
+    """
+
+    health_check_done = False
+    connect_time = 0.0
+
+    @property
+    def pool(self):
+        max_size = self.settings_dict.get('POOL_MAX_SIZE', 0)
+        if not max_size:
+            return None
+        key = self.alias, os.getpid()
+        with _pools_lock:
+            if key not in _pools:
+                params = self.get_connection_params()
+                _pools[key] = ConnectionPool(
+                    self.alias,
+                    lambda: self.open_connection(params),
+                    max_size,
+                    self.settings_dict.get('POOL_TIMEOUT', 10),
+                    self.settings_dict.get('POOL_MAX_LIFETIME', 3600))
+            return _pools[key]
+
+    def get_new_connection(self, conn_params):
+        started = perf_counter()
+        pool = self.pool
+        if pool is None:
+            connection = self.open_connection(conn_params)
+        else:
+            connection = pool.acquire(self.health_checks_enabled)
+        self.connect_time = perf_counter() - started
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(
+            conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def open_connection(self, conn_params):
+        connection = Database.connect(**conn_params)
+        increment(self.alias, 'opened')
+        return connection
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def _close(self):
+        pool = self.pool
+        if pool is None:
+            increment(self.alias, 'closed')
+            return super()._close()
+        # Подключение, закрытое внутри транзакции, остается у обертки
+        # до ее отката и не может вернуться в пул.
+        with self.wrap_database_errors:
+            pool.release(self.connection, discard=self.in_atomic_block)
+
+    @property
+    def health_checks_enabled(self):
+        return self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+
+    def close_if_health_check_failed(self):
+        if (self.connection is None or self.in_atomic_block
+                or not self.health_checks_enabled or self.health_check_done):
+            return
+        if not self.is_usable():
+            increment(self.alias, 'health_check_failures')
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
+
+    def close_if_unusable_or_obsolete(self):
+        self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
+        if (self.connection is not None and self.pool is not None
+                and not self.in_atomic_block):
+            self.close()
+
+    def connection_stats(self):
+        """Счетчики подключений процесса для /metrics."""
+
+        with _stats_lock:
+            stats = {
+                name: value for (alias, name), value in _stats.items()
+                if alias == self.alias}
+        with _pools_lock:
+            pool = _pools.get((self.alias, os.getpid()))
+        if pool is not None:
+            stats.update(pool.stats())
+        return stats
@@ -0,0 +1,137 @@
+import random
+from contextvars import ContextVar
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+ROUTE = ContextVar('db_route', default=None)
+
+
+class Route:
+    """База для чтения в текущем запросе к API; None - основная."""
+
+    def __init__(self, alias=None):
+        self.alias = alias
+
+
+def sticky_cache():
+    """
+    Общий для всех процессов кэш REFERENCE_CACHE_ALIAS или None.
+
+    Отметка о записи в кэше одного процесса не видна остальным, и клиент
+    не прочитает свои изменения, поэтому без общего кэша реплики не
+    используются.
+    """
+
+    alias = settings.REFERENCE_CACHE_ALIAS
+    if not alias:
+        return None
+    cache = caches[alias]
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        return None
+    return cache
+
+
+def identity_key(identity):
+    return 'db-primary:' + md5(identity.encode()).hexdigest()
+
+
+def sticky_key(request):
+    """
+    Ключ клиента для чтения своих изменений.
+
+    Клиент определяется по заголовку Authorization или cookie сессии;
+    анонимные запросы данные не меняют.
+    """
+
+    identity = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(
+        settings.SESSION_COOKIE_NAME)
+    if not identity:
+        return None
+    return identity_key(identity)
+
+
+def issued_keys(response):
+    """
+    Ключи клиента, выданные ответом: токен после входа и новая сессия.
+
+    Вход выполняется анонимным запросом, а следующий запрос с новым
+    токеном не должен читать его с реплики, куда он еще не дошел.
+    """
+
+    keys = []
+    data = getattr(response, 'data', None)
+    if isinstance(data, dict) and data.get('auth_token'):
+        keys.append(identity_key(f'Token {data["auth_token"]}'))
+    session = response.cookies.get(settings.SESSION_COOKIE_NAME)
+    if session is not None and session.value:
+        keys.append(identity_key(session.value))
+    return keys
+
+
+def choose_route(request):
+    """Реплика для безопасного запроса, если клиент недавно ничего не менял."""
+
+    replicas = settings.DATABASE_REPLICAS
+    cache = sticky_cache()
+    if not replicas or cache is None or request.method not in SAFE_METHODS:
+        return Route()
+    key = sticky_key(request)
+    if key is not None and cache.get(key):
+        return Route()
+    return Route(random.choice(replicas))
+
+
+def remember_write(request, response):
+    """Чтение с основной базы в течение REPLICA_STICKY_SECONDS после записи."""
+
+    cache = sticky_cache()
+    if (not settings.DATABASE_REPLICAS or cache is None
+            or request.method in SAFE_METHODS or response.status_code >= 400):
+        return
+    keys = [sticky_key(request), *issued_keys(response)]
+    cache.set_many(
+        dict.fromkeys(filter(None, keys), 1),
+        timeout=settings.REPLICA_STICKY_SECONDS)
+
+
+def use_primary():
+    """Чтение с основной базы до конца текущего запроса к API."""
+
+    route = ROUTE.get()
+    if route is not None:
+        route.alias = None
+
+
+class ReplicaRouter:
+    """
+    Чтение с реплики, выбранной ReplicaRoutingMiddleware.
+
+    Запись всегда идет в основную базу, и после нее запрос до конца
+    читает оттуда же. Внутри транзакции чтение тоже идет в основную базу.
+    Вне запросов к API (команды, фоновые потоки) реплики не используются.
+    """
+
+    def db_for_read(self, model, **hints):
+        route = ROUTE.get()
+        if route is None:
+            return None
+        if (route.alias is None
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return route.alias
+
+    def db_for_write(self, model, **hints):
+        use_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
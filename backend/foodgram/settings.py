@@ -32,6 +32,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
+    'api.middleware.RequestVersionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,15 +70,44 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 # Database
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'foodgram.db',
         'NAME': os.getenv('DB_NAME', default='postgres'),
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', default='db'),
         'PORT': os.getenv('DB_PORT', default='5432'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default='60')),
+        'CONN_HEALTH_CHECKS': os.getenv(
+            'DB_CONN_HEALTH_CHECKS', default='1') == '1',
+        'POOL_MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', default='0')),
+        'POOL_TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', default='10')),
+        'POOL_MAX_LIFETIME': int(
+            os.getenv('DB_POOL_MAX_LIFETIME', default='3600')),
+        'OPTIONS': {
+            'connect_timeout': int(
+                os.getenv('DB_CONNECT_TIMEOUT', default='5')),
+        },
     }
 }
 
+# Реплики для чтения: DB_REPLICA_HOSTS=host1,host2:5433
+DATABASE_REPLICAS = []
+for number, replica in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', default='').split(',')),
+        start=1):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{number}')
+
+DATABASE_ROUTERS = ['foodgram.db.routers.ReplicaRouter']
+REPLICA_STICKY_SECONDS = int(
+    os.getenv('DB_REPLICA_STICKY_SECONDS', default='10'))
+
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -149,3 +181,46 @@ DJOSER = {
 }
 
 MIN_VALUE = 0
+
+RECIPES_PAGE_SIZE = 6
+
+INGREDIENT_SEARCH_BACKEND = os.getenv('INGREDIENT_SEARCH_BACKEND')
+INGREDIENT_SEARCH_LIMIT = 20
+RECIPE_SEARCH_LIMIT = 100
+# Сколько последних изменений рецептов хранится для обновления индекса
+# поиска по ингредиентам без полного перестроения.
+RECIPE_SEARCH_CHANGELOG_LENGTH = 1000
+
+REFERENCE_CACHE_ALIAS = os.getenv('REFERENCE_CACHE_ALIAS')
+
+REQUEST_METRICS_SAMPLE_RATE = float(
+    os.getenv('REQUEST_METRICS_SAMPLE_RATE', default='0.1'))
+REQUEST_METRICS_NPLUSONE_THRESHOLD = 5
+# Без токена и адресов /metrics недоступен.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', default='')
+METRICS_ALLOWED_IPS = list(
+    filter(None, os.getenv('METRICS_ALLOWED_IPS', default='').split(',')))
+
+RECIPE_IMAGE_POLL_SECONDS = int(
+    os.getenv('RECIPE_IMAGE_POLL_SECONDS', default='5'))
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': 320,
+    'medium': 960,
+}
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', default=str(15 * 1024 * 1024)))
+
+TRENDING_HALF_LIFE_HOURS = 24
+TRENDING_LAG_SECONDS = 60
+TRENDING_MIN_SCORE = 0.01
+
+FEED_TIMELINE_LENGTH = 500
+FEED_FANOUT_MAX_FOLLOWERS = 1000
+
+ASYNC_DB_POOL_SIZE = int(os.getenv('ASYNC_DB_POOL_SIZE', default='8'))
+
+RESPONSE_CACHE_TIMEOUT = int(
+    os.getenv('RESPONSE_CACHE_TIMEOUT', default='300'))
+
+RECIPE_FAST_SERIALIZER = os.getenv(
+    'RECIPE_FAST_SERIALIZER', default='') == '1'
@@ -1,7 +1,8 @@
 from django.contrib import admin
 
 from .models import (FavoriteReceipe, Ingredient, IngredientInRecipesAmount,
-                     Recipe, ShoppingCart, Tag)
+                     Recipe, RecipeTag, ShoppingCart, ShoppingCartIngredient,
+                     Tag)
 
 
 @admin.register(Ingredient)
@@ -35,16 +36,24 @@ class IngredientInRecipesAmountInline(admin.TabularInline):
     min_num = 1
 
 
+class RecipeTagInline(admin.TabularInline):
+    """Отображение тэгов в рецептах в админ панели."""
+    model = RecipeTag
+    extra = 1
+    min_num = 1
+
+
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     """Административная панель управления рецептами."""
     list_display = ('name', 'author', 'get_in_favorites')
     list_filter = ('name', 'author', 'tags',)
-    inlines = (IngredientInRecipesAmountInline,)
+    inlines = (IngredientInRecipesAmountInline, RecipeTagInline,)
     empty_value_display = '-пусто-'
 
+    @admin.display(description='в избранном')
     def get_in_favorites(self, obj):
-        return obj.favorite_recipes.count()
+        return obj.favorites_count
 
 
 @admin.register(FavoriteReceipe)
@@ -63,3 +72,11 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     list_filter = ('user', 'recipe',)
     search_fields = ('user', )
     empty_value_display = '-пусто-'
+
+
+@admin.register(ShoppingCartIngredient)
+class ShoppingCartIngredientAdmin(admin.ModelAdmin):
+    """Административная панель сводных списков покупок."""
+    list_display = ('user', 'ingredient', 'amount',)
+    list_filter = ('user',)
+    empty_value_display = '-пусто-'
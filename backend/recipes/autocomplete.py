@@ -0,0 +1,119 @@
+from bisect import bisect_left
+from threading import Lock
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Collate, Lower
+
+from .cache import INGREDIENT_CACHE
+from .models import Ingredient
+
+TRIGRAM_SIZE = 3
+
+
+class MemoryIngredientIndex:
+    """
+    Индекс названий ингредиентов в памяти процесса.
+
+    Названия хранятся отсортированными: совпадения по началу названия
+    находятся бинарным поиском, совпадения внутри названия - по индексу
+    триграмм с позициями в отсортированном списке. Индекс строится из
+    INGREDIENT_CACHE и перестраивается при смене его версии.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.source = None
+        self.names = []
+        self.ids = []
+        self.trigrams = {}
+
+    def build(self, ingredients):
+        rows = sorted(
+            (ingredient.name.lower(), pk)
+            for pk, ingredient in ingredients.items())
+        trigrams = {}
+        for position, (name, _) in enumerate(rows):
+            for trigram in {name[i:i + TRIGRAM_SIZE]
+                            for i in range(len(name) - TRIGRAM_SIZE + 1)}:
+                trigrams.setdefault(trigram, []).append(position)
+        self.ids = [pk for _, pk in rows]
+        self.trigrams = trigrams
+        self.names = [name for name, _ in rows]
+        self.source = ingredients
+
+    def candidates(self, query):
+        """Позиции названий, которые могут содержать query."""
+
+        if len(query) < TRIGRAM_SIZE:
+            return range(len(self.names))
+        postings = sorted(
+            (self.trigrams.get(query[i:i + TRIGRAM_SIZE], ())
+             for i in range(len(query) - TRIGRAM_SIZE + 1)),
+            key=len)
+        positions = set(postings[0])
+        for posting in postings[1:]:
+            positions.intersection_update(posting)
+        return sorted(positions)
+
+    def search(self, query, limit):
+        ingredients = INGREDIENT_CACHE.load()
+        with self.lock:
+            if self.source is not ingredients:
+                self.build(ingredients)
+            names, ids = self.names, self.ids
+        query = query.lower()
+        result = []
+        position = bisect_left(names, query)
+        while (position < len(names) and len(result) < limit
+               and names[position].startswith(query)):
+            result.append(ids[position])
+            position += 1
+        for position in self.candidates(query):
+            if len(result) >= limit:
+                break
+            name = names[position]
+            if query in name and not name.startswith(query):
+                result.append(ids[position])
+        return result
+
+
+class DatabaseIngredientIndex:
+    """
+    Поиск ингредиентов в PostgreSQL.
+
+    Совпадения по началу названия без учета регистра берутся из индекса
+    ingredient_lower_name_idx по LOWER(name) COLLATE "C" уже в порядке
+    выдачи, поиск внутри названия выполняется, только если их меньше
+    limit.
+    """
+
+    def search(self, query, limit):
+        ingredients = Ingredient.objects.annotate(
+            lower_name=Collate(Lower('name'), 'C'))
+        prefix = Q(lower_name__startswith=query.lower())
+        result = list(ingredients.filter(prefix).order_by(
+            'lower_name').values_list('pk', flat=True)[:limit])
+        if len(result) < limit:
+            result += ingredients.filter(
+                name__icontains=query,
+            ).exclude(prefix).order_by('name').values_list(
+                'pk', flat=True)[:limit - len(result)]
+        return result
+
+
+INGREDIENT_INDEXES = {
+    'memory': MemoryIngredientIndex(),
+    'database': DatabaseIngredientIndex(),
+}
+
+
+def get_ingredient_index():
+    """Индекс поиска, выбранный в настройках или по типу базы данных."""
+
+    backend = getattr(settings, 'INGREDIENT_SEARCH_BACKEND', None)
+    if backend is None:
+        backend = (
+            'database' if connection.vendor == 'postgresql' else 'memory')
+    return INGREDIENT_INDEXES[backend]
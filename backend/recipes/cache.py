@@ -0,0 +1,232 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from hashlib import md5
+from threading import Lock, local
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import DataVersion, Ingredient, Tag
+
+# Версии, уже прочитанные в текущем запросе, см. request_versions.
+REQUEST_VERSIONS = ContextVar('request_versions', default=None)
+
+
+def shared_cache():
+    """Общий кэш REFERENCE_CACHE_ALIAS или None, если он не задан."""
+
+    alias = settings.REFERENCE_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+@contextmanager
+def request_versions():
+    """
+    Каждая версия читается не больше одного раза за запрос.
+
+    Изменения из других процессов становятся видны со следующего
+    запроса, свои - сразу.
+    """
+
+    token = REQUEST_VERSIONS.set({})
+    try:
+        yield
+    finally:
+        REQUEST_VERSIONS.reset(token)
+
+
+def current_versions(keys, initial=time.time_ns):
+    """
+    Текущие версии по ключам из общего кэша или таблицы DataVersion.
+
+    Отсутствующая в кэше версия создается вызовом initial (по умолчанию
+    от текущего времени), поэтому после вытеснения она не совпадет ни с
+    одной из прежних.
+    """
+
+    memo = REQUEST_VERSIONS.get()
+    if memo is None:
+        return read_versions(keys, initial)
+    missing = [key for key in keys if key not in memo]
+    if missing:
+        memo.update(read_versions(missing, initial))
+    return {key: memo[key] for key in keys}
+
+
+def read_versions(keys, initial):
+    cache = shared_cache()
+    if cache is None:
+        return DataVersion.objects.current(keys)
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, initial(), timeout=None)
+        found.update(cache.get_many(missing))
+    return found
+
+
+def bump_versions(keys):
+    """Новые версии по ключам во всех процессах."""
+
+    cache = shared_cache()
+    if cache is None:
+        versions = DataVersion.objects.bump(keys)
+    else:
+        versions = {}
+        for key in keys:
+            try:
+                versions[key] = cache.incr(key)
+            except ValueError:
+                cache.add(key, time.time_ns(), timeout=None)
+                versions[key] = cache.get(key)
+    memo = REQUEST_VERSIONS.get()
+    if memo is not None:
+        memo.update(versions)
+    return versions
+
+
+def stamp_versions(keys):
+    """Время изменения в наносекундах как новая версия по ключам."""
+
+    stamp = time.time_ns()
+    cache = shared_cache()
+    if cache is None:
+        DataVersion.objects.stamp(keys, stamp)
+    else:
+        cache.set_many(dict.fromkeys(keys, stamp), timeout=None)
+    memo = REQUEST_VERSIONS.get()
+    if memo is not None:
+        for key in keys:
+            memo.pop(key, None)
+
+
+class CommitBatch:
+    """
+    Ключи, накопленные за транзакцию, передаются в callback одним вызовом.
+
+    Каждый add регистрирует on_commit, но ключи забирает только первый
+    вызов после фиксации, остальные ничего не делают. Ключи из
+    откаченной транзакции уходят в callback со следующей фиксацией:
+    лишний сброс кэша безопасен.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.local = local()
+
+    def add(self, *keys):
+        pending = getattr(self.local, 'keys', None)
+        if pending is None:
+            pending = self.local.keys = set()
+        pending.update(keys)
+        transaction.on_commit(self.flush)
+
+    def flush(self):
+        keys = getattr(self.local, 'keys', None)
+        if keys:
+            self.local.keys = set()
+            self.callback(keys)
+
+
+class VersionCounter:
+    """
+    Счетчик версии данных для сброса кэшей в памяти.
+
+    Версия хранится в общем кэше REFERENCE_CACHE_ALIAS, а без него - в
+    таблице DataVersion, поэтому изменения видны всем процессам.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def current(self):
+        return current_versions([self.key])[self.key]
+
+    def bump(self):
+        """Новая версия данных во всех процессах."""
+
+        return bump_versions([self.key])[self.key]
+
+
+class ReferenceCache:
+    """
+    Кэш справочной таблицы в памяти процесса.
+
+    Таблица загружается целиком и перечитывается при смене версии.
+    Версия увеличивается при сохранении и удалении объектов.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.counter = VersionCounter(
+            f'reference-cache:{model._meta.label_lower}:version')
+        self.lock = Lock()
+        self.version = None
+        self.objects = {}
+        self.etag = None
+
+    def bump(self):
+        """Сброс кэша во всех процессах."""
+
+        self.counter.bump()
+
+    def load(self):
+        """Объекты таблицы по первичному ключу."""
+
+        version = self.counter.current()
+        with self.lock:
+            if self.version != version:
+                self.objects = {
+                    obj.pk: obj for obj in self.model.objects.order_by('pk')}
+                fields = self.model._meta.concrete_fields
+                self.etag = md5(repr([
+                    [getattr(obj, field.attname) for field in fields]
+                    for obj in self.objects.values()
+                ]).encode()).hexdigest()
+                self.version = version
+            return self.objects
+
+    def all(self):
+        return list(self.load().values())
+
+    def get(self, pk):
+        return self.get_many([pk]).get(pk)
+
+    def get_many(self, pks):
+        """
+        Объекты по списку ключей.
+
+        Ключи, которых нет в кэше, запрашиваются из базы одним запросом:
+        версия меняется только после фиксации транзакции, и новый объект
+        может еще отсутствовать в кэше процесса.
+        """
+
+        objects = self.load()
+        found = {pk: objects[pk] for pk in pks if pk in objects}
+        missing = [pk for pk in pks if pk not in found]
+        if missing:
+            found.update(self.model.objects.in_bulk(missing))
+        return found
+
+    def get_etag(self):
+        self.load()
+        return f'"{self.etag}"'
+
+
+TAG_CACHE = ReferenceCache(Tag)
+INGREDIENT_CACHE = ReferenceCache(Ingredient)
+REFERENCE_CACHES = {cache.model: cache for cache in (TAG_CACHE,
+                                                     INGREDIENT_CACHE)}
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def bump_reference_cache(sender, **kwargs):
+    transaction.on_commit(REFERENCE_CACHES[sender].bump)
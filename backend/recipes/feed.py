@@ -0,0 +1,118 @@
+from heapq import merge
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from users.models import Follow, User
+
+from .models import FeedEntry, Recipe
+
+FANOUT_BATCH_SIZE = 1000
+
+
+def is_fanout_author(author):
+    """Рецепты автора рассылаются по лентам, если подписчиков немного."""
+
+    return author.followers_count <= settings.FEED_FANOUT_MAX_FOLLOWERS
+
+
+def fan_out(recipe):
+    """Добавление нового рецепта в ленты подписчиков автора."""
+
+    if not is_fanout_author(recipe.author):
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=recipe.author_id).values_list('user_id', flat=True)
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(
+            user_id=user_id, recipe_id=recipe.pk,
+            author_id=recipe.author_id, pub_date=recipe.pub_date)
+         for user_id in follower_ids.iterator()),
+        batch_size=FANOUT_BATCH_SIZE,
+        ignore_conflicts=True)
+
+
+def backfill(user, author):
+    """Последние рецепты автора в ленте нового подписчика."""
+
+    if not is_fanout_author(author):
+        return
+    recipes = Recipe.objects.filter(author=author).order_by(
+        '-pub_date', '-id').values_list('pk', 'pub_date')
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(
+            user_id=user.pk, recipe_id=recipe_id,
+            author_id=author.pk, pub_date=pub_date)
+         for recipe_id, pub_date
+         in recipes[:settings.FEED_TIMELINE_LENGTH]],
+        batch_size=FANOUT_BATCH_SIZE,
+        ignore_conflicts=True)
+    trim_timeline(user)
+
+
+def prune(user, author):
+    """Удаление рецептов автора из ленты после отписки."""
+
+    FeedEntry.objects.filter(user=user, author=author).delete()
+
+
+def trim_timeline(user):
+    """Удаление записей ленты сверх FEED_TIMELINE_LENGTH."""
+
+    entries = FeedEntry.objects.filter(user=user).order_by(
+        '-pub_date', '-recipe_id')
+    oldest = entries.values_list('pub_date', 'recipe_id')[
+        settings.FEED_TIMELINE_LENGTH:settings.FEED_TIMELINE_LENGTH + 1]
+    if not oldest:
+        return
+    pub_date, recipe_id = oldest[0]
+    entries.filter(
+        Q(pub_date__lt=pub_date)
+        | Q(pub_date=pub_date, recipe_id__lte=recipe_id)).delete()
+
+
+def older_than(position, date_field, id_field):
+    """Условие на записи ленты, идущие после position."""
+
+    if position is None:
+        return Q()
+    pub_date, recipe_id = position
+    return Q(**{f'{date_field}__lt': pub_date}) | Q(
+        **{date_field: pub_date, f'{id_field}__lt': recipe_id})
+
+
+def get_feed(user, position=None, size=None):
+    """
+    Позиции (pub_date, recipe_id) ленты подписок после position.
+
+    Записи из ленты пользователя объединяются с рецептами популярных
+    авторов, которые читаются напрямую.
+    """
+
+    size = size or settings.RECIPES_PAGE_SIZE
+    timeline = FeedEntry.objects.filter(
+        older_than(position, 'pub_date', 'recipe_id'), user=user,
+    ).order_by('-pub_date', '-recipe_id').values_list(
+        'pub_date', 'recipe_id')[:size]
+    popular_authors = User.objects.filter(
+        following__user=user,
+        followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS)
+    pulled = Recipe.objects.filter(
+        older_than(position, 'pub_date', 'id'), author__in=popular_authors,
+    ).order_by('-pub_date', '-id').values_list('pub_date', 'pk')[:size]
+    positions = []
+    for item in merge(timeline, pulled, reverse=True):
+        # Рецепт автора, ставшего популярным, может быть в обоих списках.
+        if positions and positions[-1] == item:
+            continue
+        positions.append(item)
+        if len(positions) == size:
+            break
+    return positions
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    if created:
+        fan_out(instance)
@@ -0,0 +1,114 @@
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import ImageVariantsTask, Recipe
+from .response_cache import RESPONSE_CACHE
+
+IMAGE_FORMATS = {
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+
+
+def render_variants(name):
+    """
+    Уменьшенные копии фотографии в JPEG и WebP.
+
+    Возвращает словарь вида {'source': имя, размер: {формат: имя}}.
+    """
+
+    with default_storage.open(name) as file, Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        stem = PurePosixPath(name).stem
+        variants = {'source': name}
+        for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            variants[variant] = {}
+            for extension, (fmt, params) in IMAGE_FORMATS.items():
+                buffer = BytesIO()
+                resized.save(buffer, fmt, **params)
+                variants[variant][extension] = default_storage.save(
+                    f'recipes/variants/{stem}-{variant}.{extension}',
+                    ContentFile(buffer.getvalue()))
+    return variants
+
+
+def variant_files(variants):
+    return [
+        path for variant, files in variants.items()
+        if variant != 'source' for path in files.values()]
+
+
+def build_variants(recipe_id):
+    """Создание копий фотографии рецепта и удаление прежних."""
+
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'image', 'image_variants').first()
+    if recipe is None or not recipe.image:
+        return
+    name = recipe.image.name
+    if recipe.image_variants.get('source') == name:
+        return
+    variants = render_variants(name)
+    updated = Recipe.objects.filter(pk=recipe_id, image=name).update(
+        image_variants=variants)
+    if updated:
+        RESPONSE_CACHE.invalidate(f'recipe:{recipe_id}')
+    # Если фотографию успели заменить, копии уже не нужны.
+    stale = (
+        variant_files(recipe.image_variants) if updated
+        else variant_files(variants))
+    for path in stale:
+        default_storage.delete(path)
+
+
+def run_next_task(created_before):
+    """
+    Выполнение самой старой задачи, поставленной до created_before.
+
+    Задача блокируется до конца транзакции, поэтому несколько
+    обработчиков не берут одну и ту же. Возвращает id рецепта или None,
+    если таких задач нет. Задача с ошибкой переносится в конец очереди.
+    """
+
+    error = None
+    with transaction.atomic():
+        task = ImageVariantsTask.objects.filter(
+            created__lt=created_before).select_for_update(
+                skip_locked=True).first()
+        if task is None:
+            return None
+        recipe_id = task.recipe_id
+        try:
+            with transaction.atomic():
+                build_variants(recipe_id)
+        except Exception as exception:
+            error = exception
+            task.created = timezone.now()
+            task.save(update_fields=['created'])
+        else:
+            task.delete()
+    if error is not None:
+        raise error
+    return recipe_id
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, **kwargs):
+    if (instance.image
+            and instance.image_variants.get('source') != instance.image.name):
+        ImageVariantsTask.objects.bulk_create(
+            [ImageVariantsTask(recipe_id=instance.pk)],
+            ignore_conflicts=True)
@@ -0,0 +1,72 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from recipes.images import run_next_task
+from recipes.models import ImageVariantsTask, Recipe
+
+ENQUEUE_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Создание уменьшенных копий фотографий рецептов из очереди "
+        "задач; с --watch команда ждет новые задачи")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='поставить в очередь все рецепты с фотографиями')
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help='не завершаться, а проверять очередь каждые '
+                 'RECIPE_IMAGE_POLL_SECONDS секунд')
+
+    def enqueue_all(self):
+        recipes = Recipe.objects.exclude(image='').only(
+            'image_variants').order_by('pk')
+        tasks = []
+        for recipe in recipes.iterator():
+            # Прежние копии удалятся после создания новых.
+            Recipe.objects.filter(pk=recipe.pk).update(
+                image_variants={**recipe.image_variants, 'source': None})
+            tasks.append(ImageVariantsTask(recipe_id=recipe.pk))
+            if len(tasks) == ENQUEUE_BATCH_SIZE:
+                ImageVariantsTask.objects.bulk_create(
+                    tasks, ignore_conflicts=True)
+                tasks = []
+        ImageVariantsTask.objects.bulk_create(tasks, ignore_conflicts=True)
+
+    def run_queue(self):
+        """Один проход по задачам, поставленным до его начала."""
+
+        started = timezone.now()
+        processed = failed = 0
+        while True:
+            try:
+                recipe_id = run_next_task(started)
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'{error}')
+                continue
+            if recipe_id is None:
+                return processed, failed
+            processed += 1
+
+    def handle(self, *args, **options):
+        if options['all']:
+            self.enqueue_all()
+        while True:
+            processed, failed = self.run_queue()
+            if processed or failed or not options['watch']:
+                self.stdout.write(
+                    f'Обработано: {processed}, ошибок: {failed}')
+            if not options['watch']:
+                break
+            time.sleep(settings.RECIPE_IMAGE_POLL_SECONDS)
+        self.stdout.write(
+            self.style.SUCCESS("***Копии фотографий созданы***")
+        )
@@ -0,0 +1,117 @@
+import csv
+import io
+import json
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes.cache import INGREDIENT_CACHE
+from recipes.models import Ingredient
+
+DEFAULT_FILE = Path(settings.BASE_DIR) / 'recipes' / 'data' / 'ingredients.csv'
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            name, measurement_unit = row
+            yield name, measurement_unit
+
+
+def read_json(file):
+    for item in json.load(file):
+        yield item['name'], item['measurement_unit']
+
+
+def read_jsonl(file):
+    for line in file:
+        if line.strip():
+            item = json.loads(line)
+            yield item['name'], item['measurement_unit']
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+    '.jsonl': read_jsonl,
+}
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    chunk = list(islice(rows, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(rows, size))
+
+
+def copy_chunk(chunk):
+    """Загрузка части строк через COPY во временную таблицу и upsert."""
+
+    table = connection.ops.quote_name(Ingredient._meta.db_table)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(chunk)
+    buffer.seek(0)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS ingredient_import '
+            '(name varchar(200), measurement_unit varchar(200)) '
+            'ON COMMIT DELETE ROWS')
+        cursor.copy_expert(
+            'COPY ingredient_import (name, measurement_unit) '
+            'FROM STDIN WITH (FORMAT csv)', buffer)
+        cursor.execute(
+            f'INSERT INTO {table} (name, measurement_unit) '
+            'SELECT DISTINCT name, measurement_unit FROM ingredient_import '
+            'ON CONFLICT (name, measurement_unit) DO NOTHING')
+
+
+def bulk_create_chunk(chunk):
+    Ingredient.objects.bulk_create(
+        (Ingredient(name=name, measurement_unit=measurement_unit)
+         for name, measurement_unit in chunk),
+        ignore_conflicts=True)
+
+
+class Command(BaseCommand):
+    help = "Загрузка ингредиентов из файлов CSV, JSON или JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*', default=[DEFAULT_FILE],
+            help='файлы с ингредиентами (.csv, .json, .jsonl)')
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='число строк в одной пачке')
+
+    def handle(self, *args, **options):
+        load_chunk = (
+            copy_chunk if connection.vendor == 'postgresql'
+            else bulk_create_chunk)
+        for path in map(Path, options['paths']):
+            reader = READERS.get(path.suffix.lower())
+            if reader is None:
+                raise CommandError(f'Неизвестный формат файла {path}')
+            before = Ingredient.objects.count()
+            started = perf_counter()
+            rows = 0
+            with open(path, encoding='utf-8') as file:
+                for chunk in chunked(reader(file), options['chunk_size']):
+                    chunk = [
+                        (name.strip(), measurement_unit.strip())
+                        for name, measurement_unit in chunk]
+                    load_chunk(chunk)
+                    rows += len(chunk)
+            elapsed = perf_counter() - started
+            created = Ingredient.objects.count() - before
+            self.stdout.write(
+                f'{path}: строк {rows}, добавлено {created}, '
+                f'пропущено {rows - created}, {elapsed:.2f} с, '
+                f'{rows / elapsed if elapsed else rows:.0f} строк/с')
+        INGREDIENT_CACHE.bump()
+        self.stdout.write(
+            self.style.SUCCESS("***Ингредиенты успешно загружены***")
+        )
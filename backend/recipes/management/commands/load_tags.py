@@ -1,4 +1,5 @@
 from django.core.management import BaseCommand
+from recipes.cache import TAG_CACHE
 from recipes.models import Tag
 
 
@@ -12,6 +13,7 @@ class Command(BaseCommand):
             {"name": "ужин", "color": "#c72de2", "slug": "supper"},
         ]
         Tag.objects.bulk_create(Tag(**tag) for tag in data)
+        TAG_CACHE.bump()
         self.stdout.write(
             self.style.SUCCESS("***Тэги успешно загружены***")
         )
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from recipes.feed import FANOUT_BATCH_SIZE, trim_timeline
+from recipes.models import FeedEntry, Recipe
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Построение лент подписок и обрезка длинных лент"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--trim',
+            action='store_true',
+            help='только обрезать ленты длиннее FEED_TIMELINE_LENGTH')
+
+    def handle(self, *args, **options):
+        if options['trim']:
+            users = User.objects.annotate(
+                entries=Count('feed_entries'),
+            ).filter(entries__gt=settings.FEED_TIMELINE_LENGTH)
+            trimmed = 0
+            for user in users.iterator():
+                trim_timeline(user)
+                trimmed += 1
+            self.stdout.write(f'Обрезано лент: {trimmed}')
+            return
+        users = User.objects.filter(follower__isnull=False).distinct()
+        built = 0
+        for user in users.iterator():
+            recipes = Recipe.objects.filter(
+                author__following__user=user,
+                author__followers_count__lte=(
+                    settings.FEED_FANOUT_MAX_FOLLOWERS),
+            ).order_by('-pub_date', '-id').values_list(
+                'pk', 'author_id', 'pub_date')
+            with transaction.atomic():
+                FeedEntry.objects.filter(user=user).delete()
+                FeedEntry.objects.bulk_create(
+                    (FeedEntry(
+                        user=user, recipe_id=recipe_id,
+                        author_id=author_id, pub_date=pub_date)
+                     for recipe_id, author_id, pub_date
+                     in recipes[:settings.FEED_TIMELINE_LENGTH]),
+                    batch_size=FANOUT_BATCH_SIZE)
+            built += 1
+        self.stdout.write(f'Построено лент: {built}')
+        self.stdout.write(
+            self.style.SUCCESS("***Ленты подписок построены***")
+        )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipes.models import ShoppingCartIngredient
+
+REBUILD_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Проверка сводных списков покупок и пересчет списков "
+        "пользователей с расхождениями")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='только сравнить сводную таблицу с исходными данными')
+
+    def handle(self, *args, **options):
+        expected = {
+            (row['user_id'], row['ingredient_id']): row['amount']
+            for row in ShoppingCartIngredient.objects.calculate()}
+        actual = dict(
+            ((user_id, ingredient_id), amount)
+            for user_id, ingredient_id, amount
+            in ShoppingCartIngredient.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'))
+        mismatched = {
+            key for key in expected.keys() | actual.keys()
+            if expected.get(key) != actual.get(key)}
+        users = {user_id for user_id, _ in mismatched}
+        self.stdout.write(
+            f'Расхождений: {len(mismatched)} '
+            f'у пользователей: {len(users)}')
+        if options['verify']:
+            if mismatched:
+                raise CommandError('Сводные списки покупок не совпадают')
+            return
+        users = sorted(users)
+        for start in range(0, len(users), REBUILD_BATCH_SIZE):
+            ShoppingCartIngredient.objects.rebuild(
+                users[start:start + REBUILD_BATCH_SIZE])
+        self.stdout.write(
+            self.style.SUCCESS("***Списки покупок пересчитаны***")
+        )
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from recipes.models import FavoriteReceipe, Recipe, ShoppingCart
+from users.models import Follow, User
+
+
+def count_subquery(model, field):
+    """Число строк model, ссылающихся на текущий объект через field."""
+
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by().values(field)
+            .annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField()),
+        0)
+
+
+COUNTERS = (
+    (Recipe, 'favorites_count', FavoriteReceipe, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = "Проверка и исправление счетчиков рецептов и пользователей"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='только сравнить счетчики с исходными данными')
+
+    def handle(self, *args, **options):
+        drifted = 0
+        for model, field, source, source_field in COUNTERS:
+            actual = count_subquery(source, source_field)
+            with transaction.atomic():
+                pks = list(
+                    model.objects.annotate(actual=actual)
+                    .filter(~Q(**{field: F('actual')}))
+                    .values_list('pk', flat=True))
+                if pks and not options['verify']:
+                    model.objects.filter(pk__in=pks).update(
+                        **{field: actual})
+            drifted += len(pks)
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}.{field}: '
+                f'расхождений {len(pks)}')
+        if options['verify']:
+            if drifted:
+                raise CommandError('Счетчики не совпадают')
+            return
+        self.stdout.write(
+            self.style.SUCCESS("***Счетчики пересчитаны***")
+        )
@@ -0,0 +1,26 @@
+from time import perf_counter, sleep
+
+from django.core.management.base import BaseCommand
+from recipes.trending import refresh_trending
+
+
+class Command(BaseCommand):
+    help = "Обновление рейтинга популярных рецептов по новым событиям"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='повторять обновление каждые N секунд')
+
+    def handle(self, *args, **options):
+        while True:
+            started = perf_counter()
+            events = refresh_trending()
+            self.stdout.write(
+                f'Учтено событий: {events}, '
+                f'{perf_counter() - started:.2f} с')
+            if not options['interval']:
+                break
+            sleep(options['interval'])
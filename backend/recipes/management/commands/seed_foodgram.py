@@ -0,0 +1,191 @@
+import random
+from itertools import accumulate, islice
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.cache import TAG_CACHE
+from recipes.models import (FavoriteReceipe, Ingredient,
+                            IngredientInRecipesAmount, Recipe, RecipeTag,
+                            ShoppingCart, Tag)
+from users.models import Follow, User
+
+DEFAULT_TAGS = (
+    {'name': 'завтрак', 'color': '#48e22d', 'slug': 'breakfast'},
+    {'name': 'обед', 'color': '#2da3e2', 'slug': 'dinner'},
+    {'name': 'ужин', 'color': '#c72de2', 'slug': 'supper'},
+)
+
+
+class ZipfSampler:
+    """
+    Выбор элементов с распределением Ципфа: элемент с рангом r
+    выбирается с весом 1 / r ** exponent.
+    """
+
+    def __init__(self, items, exponent, rng):
+        self.items = list(items)
+        self.rng = rng
+        self.cum_weights = list(accumulate(
+            1 / rank ** exponent for rank in range(1, len(self.items) + 1)))
+
+    def sample(self, count, exclude=None):
+        """До count различных элементов, кроме exclude."""
+
+        count = min(count, len(self.items) - (exclude is not None))
+        chosen = set()
+        for _ in range(count * 4):
+            if len(chosen) >= count:
+                break
+            item = self.rng.choices(
+                self.items, cum_weights=self.cum_weights)[0]
+            if item != exclude:
+                chosen.add(item)
+        return chosen
+
+
+class Command(BaseCommand):
+    help = "Генерация тестовых данных Foodgram в заданном масштабе"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument(
+            '--recipes', type=int, default=10000,
+            help='число рецептов; авторы выбираются по закону Ципфа')
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='среднее число подписок на пользователя')
+        parser.add_argument(
+            '--favorites', type=int, default=30,
+            help='среднее число избранных рецептов на пользователя')
+        parser.add_argument(
+            '--cart', type=int, default=5,
+            help='среднее число рецептов в списке покупок')
+        parser.add_argument(
+            '--ingredients', type=int, default=8,
+            help='среднее число ингредиентов в рецепте')
+        parser.add_argument(
+            '--exponent', type=float, default=1.1,
+            help='показатель распределения Ципфа')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.exponent = options['exponent']
+        ingredient_ids = list(
+            Ingredient.objects.values_list('pk', flat=True))
+        if not ingredient_ids:
+            raise CommandError(
+                'Нет ингредиентов: сначала выполните load_ingredients')
+        if not Tag.objects.exists():
+            Tag.objects.bulk_create(Tag(**tag) for tag in DEFAULT_TAGS)
+            TAG_CACHE.bump()
+        tag_ids = list(Tag.objects.values_list('pk', flat=True))
+        run = f'seed{self.rng.randrange(16 ** 6):06x}'
+        with transaction.atomic():
+            user_ids = self.step('пользователи', self.create_users,
+                                 run, options['users'])
+            recipe_ids = self.step(
+                'рецепты', self.create_recipes, run, user_ids,
+                options['recipes'])
+            self.step('тэги рецептов', self.create_links, RecipeTag,
+                      'recipe_id', recipe_ids, 'tag_id', tag_ids, 2)
+            self.step('ингредиенты рецептов', self.create_amounts,
+                      recipe_ids, ingredient_ids, options['ingredients'])
+            self.step('подписки', self.create_links, Follow, 'user_id',
+                      user_ids, 'author_id', user_ids, options['follows'],
+                      True)
+            self.step('избранное', self.create_links, FavoriteReceipe,
+                      'user_id', user_ids, 'recipe_id', recipe_ids,
+                      options['favorites'])
+            self.step('списки покупок', self.create_links, ShoppingCart,
+                      'user_id', user_ids, 'recipe_id', recipe_ids,
+                      options['cart'])
+            call_command('rebuild_shopping_cart', stdout=self.stdout)
+            call_command('reconcile_counters', stdout=self.stdout)
+            call_command('rebuild_feeds', stdout=self.stdout)
+        self.stdout.write(
+            self.style.SUCCESS("***Тестовые данные созданы***")
+        )
+
+    def step(self, title, func, *args):
+        started = perf_counter()
+        result = func(*args)
+        self.stdout.write(f'{title}: {perf_counter() - started:.1f} с')
+        return result
+
+    def bulk_create(self, model, objs, **kwargs):
+        """Вставка пачками без накопления всех объектов в памяти."""
+
+        objs = iter(objs)
+        batch = list(islice(objs, self.batch_size))
+        while batch:
+            model.objects.bulk_create(batch, **kwargs)
+            batch = list(islice(objs, self.batch_size))
+
+    def amount(self, average):
+        """Случайное число около average с длинным хвостом."""
+
+        return max(1, int(self.rng.expovariate(1 / average)))
+
+    def create_users(self, run, count):
+        password = make_password(None)
+        self.bulk_create(
+            User,
+            (User(
+                email=f'{run}-{i}@foodgram.local',
+                username=f'{run}-{i}',
+                first_name='Имя',
+                last_name='Фамилия',
+                password=password)
+             for i in range(count)))
+        return list(User.objects.filter(
+            username__startswith=f'{run}-').values_list('pk', flat=True))
+
+    def create_recipes(self, run, user_ids, count):
+        authors = ZipfSampler(user_ids, self.exponent, self.rng)
+        self.bulk_create(
+            Recipe,
+            (Recipe(
+                author_id=authors.sample(1).pop(),
+                name=f'{run} рецепт {i}',
+                text='Описание рецепта',
+                image='recipes/seed.png',
+                cooking_time=self.rng.randint(5, 180))
+             for i in range(count)))
+        return list(Recipe.objects.filter(
+            name__startswith=f'{run} ').values_list('pk', flat=True))
+
+    def create_links(self, model, owner_field, owner_ids,
+                     target_field, target_ids, average, exclude_self=False):
+        """Связи владельцев с популярными по закону Ципфа объектами."""
+
+        targets = ZipfSampler(
+            self.rng.sample(target_ids, len(target_ids)), self.exponent,
+            self.rng)
+        self.bulk_create(
+            model,
+            (model(**{owner_field: owner_id, target_field: target_id})
+             for owner_id in owner_ids
+             for target_id in targets.sample(
+                 self.amount(average),
+                 exclude=owner_id if exclude_self else None)),
+            ignore_conflicts=True)
+
+    def create_amounts(self, recipe_ids, ingredient_ids, average):
+        ingredients = ZipfSampler(
+            self.rng.sample(ingredient_ids, len(ingredient_ids)),
+            self.exponent, self.rng)
+        self.bulk_create(
+            IngredientInRecipesAmount,
+            (IngredientInRecipesAmount(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=self.rng.randint(1, 500))
+             for recipe_id in recipe_ids
+             for ingredient_id in ingredients.sample(
+                 self.amount(average))))
@@ -0,0 +1,88 @@
+# Generated by Django 3.2.9 on 2026-10-18 05:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FavoriteReceipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'verbose_name': 'избранное',
+                'verbose_name_plural': 'рецепты в избранном',
+            },
+        ),
+        migrations.CreateModel(
+            name='Ingredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='название ингредиента', max_length=200, verbose_name='ингредиент')),
+                ('measurement_unit', models.CharField(help_text='единица измерения количества ингредиента', max_length=200, verbose_name='единица измерения')),
+            ],
+            options={
+                'verbose_name': 'ингредиент',
+                'verbose_name_plural': 'ингредиенты',
+            },
+        ),
+        migrations.CreateModel(
+            name='IngredientInRecipesAmount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveSmallIntegerField(help_text='необходимое количество данного ингредиента', verbose_name='количество')),
+            ],
+            options={
+                'verbose_name': 'количество ингредиентов',
+                'verbose_name_plural': 'количество ингредиентов',
+            },
+        ),
+        migrations.CreateModel(
+            name='Recipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, verbose_name='Название рецепта')),
+                ('image', models.ImageField(upload_to='recipes/', verbose_name='Фотография готового блюда')),
+                ('text', models.TextField(verbose_name='Описание рецепта')),
+                ('cooking_time', models.IntegerField(help_text='время приготовления блюда', verbose_name='время приготовления')),
+                ('pub_date', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'рецепт',
+                'verbose_name_plural': 'рецепты',
+                'ordering': ['-pub_date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='название тэга', max_length=200, unique=True, verbose_name='название')),
+                ('color', models.CharField(help_text='HEX-код для обозначения цвета тэга', max_length=7, unique=True, verbose_name='HEX-код')),
+                ('slug', models.SlugField(help_text='имя для URL', unique=True, verbose_name='слаг')),
+            ],
+            options={
+                'verbose_name': 'тэг',
+                'verbose_name_plural': 'тэги',
+            },
+        ),
+        migrations.CreateModel(
+            name='ShoppingCart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_recipes', to='recipes.recipe', verbose_name='рецепты')),
+            ],
+            options={
+                'verbose_name': 'список покупок',
+                'verbose_name_plural': 'списки покупок',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+def create_lower_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS ingredient_lower_name_idx '
+        'ON recipes_ingredient ((LOWER(name) COLLATE "C"))')
+
+
+def drop_lower_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS ingredient_lower_name_idx')
+
+
+class Migration(migrations.Migration):
+    """
+    Индекс для поиска ингредиентов по началу названия без учета регистра.
+
+    С правилом сортировки "C" LIKE 'префикс%' использует индекс при любой
+    локали базы, а ORDER BY по тому же выражению читает совпадения из
+    индекса по порядку. Индекс нужен только DatabaseIngredientIndex,
+    который работает в PostgreSQL, в остальных базах миграция ничего
+    не делает.
+    """
+
+    dependencies = [
+        ('recipes', '0005_recipe_author_pub_date_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ingredient',
+            name='ingredient_name_prefix_idx',
+        ),
+        migrations.RunPython(create_lower_name_index, drop_lower_name_index),
+    ]
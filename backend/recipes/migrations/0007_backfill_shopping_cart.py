@@ -0,0 +1,32 @@
+from django.db import migrations
+from django.db.models import F, Sum
+
+
+def backfill_shopping_cart(apps, schema_editor):
+    IngredientInRecipesAmount = apps.get_model(
+        'recipes', 'IngredientInRecipesAmount')
+    ShoppingCartIngredient = apps.get_model(
+        'recipes', 'ShoppingCartIngredient')
+    totals = IngredientInRecipesAmount.objects.filter(
+        recipe__shopping_recipes__isnull=False,
+    ).values(
+        'ingredient_id',
+        user_id=F('recipe__shopping_recipes__user'),
+    ).annotate(amount=Sum('amount')).order_by()
+    ShoppingCartIngredient.objects.all().delete()
+    ShoppingCartIngredient.objects.bulk_create(
+        (ShoppingCartIngredient(**row) for row in totals.iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    """Заполнение сводных списков покупок по уже добавленным рецептам."""
+
+    dependencies = [
+        ('recipes', '0006_ingredient_lower_name_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_shopping_cart, migrations.RunPython.noop),
+    ]
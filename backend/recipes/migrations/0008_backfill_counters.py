@@ -0,0 +1,38 @@
+from django.db import migrations
+from django.db.models import Count, Exists, IntegerField, OuterRef, Subquery
+
+COUNTERS = (
+    ('recipes.Recipe', 'favorites_count', 'recipes.FavoriteReceipe', 'recipe'),
+    ('recipes.Recipe', 'shopping_cart_count', 'recipes.ShoppingCart', 'recipe'),
+    ('users.User', 'recipes_count', 'recipes.Recipe', 'author'),
+    ('users.User', 'followers_count', 'users.Follow', 'author'),
+)
+
+
+def backfill_counters(apps, schema_editor):
+    for model_label, field, source_label, source_field in COUNTERS:
+        model = apps.get_model(model_label)
+        references = apps.get_model(source_label).objects.filter(
+            **{source_field: OuterRef('pk')})
+        total = references.order_by().values(source_field).annotate(
+            total=Count('pk')).values('total')
+        # У объектов без ссылок счетчик остается равным нулю.
+        model.objects.filter(Exists(references)).update(
+            **{field: Subquery(total, output_field=IntegerField())})
+
+
+class Migration(migrations.Migration):
+    """
+    Заполнение счетчиков рецептов и пользователей по исходным данным.
+
+    Выполняется до построения лент: они зависят от followers_count.
+    """
+
+    dependencies = [
+        ('recipes', '0007_backfill_shopping_cart'),
+        ('users', '0002_user_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
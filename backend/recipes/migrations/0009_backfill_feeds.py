@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def backfill_feeds(apps, schema_editor):
+    FeedEntry = apps.get_model('recipes', 'FeedEntry')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    User = apps.get_model('users', 'User')
+    FeedEntry.objects.all().delete()
+    users = User.objects.filter(follower__isnull=False).distinct()
+    for user_id in users.values_list('pk', flat=True).iterator():
+        # Рецепты популярных авторов в ленту не копируются, как и при
+        # публикации: они добавляются при чтении ленты.
+        recipes = Recipe.objects.filter(
+            author__following__user_id=user_id,
+            author__followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS,
+        ).order_by('-pub_date', '-id').values_list(
+            'pk', 'author_id', 'pub_date')
+        FeedEntry.objects.bulk_create(
+            (FeedEntry(
+                user_id=user_id, recipe_id=recipe_id,
+                author_id=author_id, pub_date=pub_date)
+             for recipe_id, author_id, pub_date
+             in recipes[:settings.FEED_TIMELINE_LENGTH]),
+            batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+    """Построение лент подписок по уже опубликованным рецептам."""
+
+    dependencies = [
+        ('recipes', '0008_backfill_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_feeds, migrations.RunPython.noop),
+    ]
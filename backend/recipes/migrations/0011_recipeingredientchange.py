@@ -0,0 +1,25 @@
+# Generated by Django 3.2.9 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeIngredientChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(db_index=True, verbose_name='версия')),
+                ('recipe_id', models.BigIntegerField(verbose_name='id рецепта')),
+            ],
+            options={
+                'verbose_name': 'изменение состава рецепта',
+                'verbose_name_plural': 'изменения состава рецептов',
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.9 on 2026-10-18 07:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipeingredientchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageVariantsTask',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='image_variants_task', serialize=False, to='recipes.recipe', verbose_name='рецепт')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='создана')),
+            ],
+            options={
+                'verbose_name': 'задача обработки фотографии',
+                'verbose_name_plural': 'задачи обработки фотографий',
+                'ordering': ('created',),
+            },
+        ),
+    ]
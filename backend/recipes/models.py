@@ -1,5 +1,8 @@
-from django.db import models
-from users.models import User
+from django.db import models, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest, RowNumber
+from django.utils import timezone
+from users.models import CounterQuerySet, User
 
 
 class Tag(models.Model):
@@ -46,18 +49,75 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'ингредиент'
         verbose_name_plural = 'ингредиенты'
+        constraints = [models.UniqueConstraint(
+            fields=['name', 'measurement_unit'],
+            name='unique_ingredient_unit',)]
+        # Индекс ingredient_lower_name_idx по LOWER(name) для поиска по
+        # началу названия создается миграцией только в PostgreSQL.
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
 
 
+class RecipeQuerySet(CounterQuerySet):
+    """Набор запросов для рецептов."""
+
+    def for_read(self, user):
+        """Рецепты со всеми связанными данными для чтения."""
+
+        return self.prefetch_related(
+            models.Prefetch(
+                'author', queryset=User.objects.add_subscribed(user)),
+            models.Prefetch('tags', queryset=Tag.objects.all()),
+            models.Prefetch(
+                'recipe',
+                queryset=IngredientInRecipesAmount.objects.select_related(
+                    'ingredient')),
+        ).add_user_annotations(user)
+
+    def add_user_annotations(self, user):
+        """Флаги избранного и списка покупок для пользователя."""
+
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()))
+        return self.annotate(
+            is_favorited=models.Exists(FavoriteReceipe.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))))
+
+    def latest_by_author(self, author_ids, limit):
+        """
+        Не больше limit последних рецептов каждого из авторов.
+
+        Номер рецепта у автора считается оконной функцией по индексу
+        (author, -pub_date) в одном подзапросе на всех авторов.
+        """
+
+        ranked = self.model.objects.filter(author__in=author_ids).annotate(
+            row_number=models.Window(
+                RowNumber(), partition_by=[models.F('author')],
+                order_by=[models.F('pub_date').desc(),
+                          models.F('id').desc()]),
+        ).order_by().values('pk', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(pk__in=RawSQL(
+            f'SELECT "id" FROM ({sql}) AS "ranked" '
+            'WHERE "row_number" <= %s', (*params, limit)))
+
+
 class Recipe(models.Model):
     """Модель для рецептов."""
 
     tags = models.ManyToManyField(
         Tag,
         verbose_name='тэги',
-        help_text='тэги по рецепту',)
+        help_text='тэги по рецепту',
+        through='RecipeTag',)
 
     author = models.ForeignKey(
         User,
@@ -77,6 +137,12 @@ class Recipe(models.Model):
     image = models.ImageField('Фотография готового блюда',
                               upload_to='recipes/',)
 
+    image_variants = models.JSONField(
+        'уменьшенные копии фотографии',
+        default=dict,
+        blank=True,
+        editable=False,)
+
     text = models.TextField('Описание рецепта')
 
     cooking_time = models.IntegerField(
@@ -85,15 +151,67 @@ class Recipe(models.Model):
 
     pub_date = models.DateTimeField(auto_now_add=True)
 
+    favorites_count = models.PositiveIntegerField(
+        'в избранном',
+        default=0,
+        editable=False,)
+
+    shopping_cart_count = models.PositiveIntegerField(
+        'в списках покупок',
+        default=0,
+        editable=False,)
+
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'рецепт'
         verbose_name_plural = 'рецепты'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx',),
+            models.Index(
+                fields=['-favorites_count', '-pub_date', '-id'],
+                name='recipe_popularity_idx',),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx',)]
 
     def __str__(self):
         return self.name
 
 
+class RecipeTag(models.Model):
+    """
+    Вспомогательная модель связи рецептов и тэгов.
+
+    Индекс (tag, recipe) позволяет фильтровать рецепты по тэгам
+    подзапросом без соединения с таблицей рецептов. Модель использует
+    таблицу, созданную ранее для ManyToManyField, поэтому уникальность
+    задана так же, как у нее.
+    """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='рецепт',)
+
+    tag = models.ForeignKey(
+        Tag,
+        on_delete=models.CASCADE,
+        verbose_name='тэг',)
+
+    class Meta:
+        db_table = 'recipes_recipe_tags'
+        verbose_name = 'тэг рецепта'
+        verbose_name_plural = 'тэги рецептов'
+        unique_together = (('recipe', 'tag'),)
+        indexes = [models.Index(
+            fields=['tag', 'recipe'],
+            name='recipe_tag_tag_recipe_idx',)]
+
+
 class IngredientInRecipesAmount(models.Model):
     """
     Вспомогательная модель для просмотра количества
@@ -139,6 +257,11 @@ class FavoriteReceipe(models.Model):
         related_name='favorite_recipes',
         verbose_name='рецепты',)
 
+    created = models.DateTimeField(
+        'дата добавления',
+        default=timezone.now,
+        db_index=True,)
+
     class Meta:
         verbose_name = 'избранное'
         verbose_name_plural = 'рецепты в избранном'
@@ -163,9 +286,292 @@ class ShoppingCart(models.Model):
         related_name='shopping_recipes',
         verbose_name='рецепты',)
 
+    created = models.DateTimeField(
+        'дата добавления',
+        default=timezone.now,
+        db_index=True,)
+
     class Meta:
         verbose_name = 'список покупок'
         verbose_name_plural = 'списки покупок'
         constraints = [models.UniqueConstraint(
             fields=['user', 'recipe'],
             name='recipe_in_shopping_cart',)]
+
+
+class ShoppingCartIngredientManager(models.Manager):
+    """Поддержка сводного списка покупок в актуальном состоянии."""
+
+    def apply_changes(self, user_ids, changes):
+        """Изменение сумм ингредиентов пользователей на величины changes."""
+
+        changes = {
+            ingredient_id: delta
+            for ingredient_id, delta in changes.items() if delta}
+        user_ids = sorted(set(user_ids))
+        if not user_ids or not changes:
+            return
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(
+                pk__in=user_ids).values_list('pk', flat=True))
+            rows = self.filter(
+                user_id__in=user_ids, ingredient_id__in=changes)
+            existing = set(rows.values_list('user_id', 'ingredient_id'))
+            rows.update(amount=models.F('amount') + models.Case(
+                *(models.When(ingredient_id=ingredient_id, then=delta)
+                  for ingredient_id, delta in changes.items()),
+                output_field=models.IntegerField()))
+            self.bulk_create([
+                self.model(
+                    user_id=user_id, ingredient_id=ingredient_id,
+                    amount=delta)
+                for user_id in user_ids
+                for ingredient_id, delta in changes.items()
+                if delta > 0 and (user_id, ingredient_id) not in existing])
+            rows.filter(amount__lte=0).delete()
+
+    def add_recipe(self, user_ids, recipe, sign=1):
+        """Учет ингредиентов рецепта в списках покупок пользователей."""
+
+        self.apply_changes(user_ids, {
+            ingredient_id: sign * amount
+            for ingredient_id, amount in recipe.recipe.values_list(
+                'ingredient_id', 'amount')})
+
+    def remove_recipe(self, user_ids, recipe):
+        """Исключение ингредиентов рецепта из списков покупок."""
+
+        self.add_recipe(user_ids, recipe, sign=-1)
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """Учет изменения состава рецепта в списках покупок."""
+
+        self.apply_changes(
+            recipe.shopping_recipes.values_list('user_id', flat=True),
+            {ingredient_id: (new_amounts.get(ingredient_id, 0)
+                             - old_amounts.get(ingredient_id, 0))
+             for ingredient_id in old_amounts.keys() | new_amounts.keys()})
+
+    def calculate(self, user_ids=None):
+        """Суммы ингредиентов по спискам покупок из исходных таблиц."""
+
+        users = (
+            {} if user_ids is None
+            else {'recipe__shopping_recipes__user__in': user_ids})
+        return IngredientInRecipesAmount.objects.filter(
+            recipe__shopping_recipes__isnull=False, **users,
+        ).values(
+            'ingredient_id',
+            user_id=models.F('recipe__shopping_recipes__user'),
+        ).annotate(amount=models.Sum('amount')).order_by()
+
+    def rebuild(self, user_ids):
+        """
+        Пересчет сводных списков пользователей из исходных таблиц.
+
+        Пользователи блокируются, как в apply_changes, поэтому изменения
+        корзины ждут конца пересчета и не теряются.
+        """
+
+        user_ids = sorted(set(user_ids))
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(
+                pk__in=user_ids).values_list('pk', flat=True))
+            self.filter(user_id__in=user_ids).delete()
+            self.bulk_create(
+                (self.model(**row) for row in self.calculate(user_ids)),
+                batch_size=1000)
+
+
+class ShoppingCartIngredient(models.Model):
+    """Сводный список покупок: сумма каждого ингредиента у пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_ingredients',
+        verbose_name='пользователь')
+
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_ingredients',
+        verbose_name='ингредиент',)
+
+    amount = models.IntegerField(
+        verbose_name='количество',
+        help_text='суммарное количество ингредиента в списке покупок',)
+
+    objects = ShoppingCartIngredientManager()
+
+    class Meta:
+        verbose_name = 'ингредиент в списке покупок'
+        verbose_name_plural = 'ингредиенты в списках покупок'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'],
+            name='unique_shopping_cart_ingredient',)]
+
+
+class RecipeTrend(models.Model):
+    """
+    Рейтинг рецепта по затухающей во времени активности.
+
+    Вклад события в score равен весу события, умноженному на
+    2 ** ((время события - epoch) / период полураспада), поэтому
+    сравнение score без пересчета дает текущий порядок рецептов.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='trend',
+        verbose_name='рецепт',)
+
+    score = models.FloatField('рейтинг', default=0)
+
+    class Meta:
+        verbose_name = 'рейтинг рецепта'
+        verbose_name_plural = 'рейтинги рецептов'
+        indexes = [models.Index(
+            fields=['-score'],
+            name='recipe_trend_score_idx',)]
+
+
+class TrendingState(models.Model):
+    """Точка отсчета рейтинга и граница уже учтенных событий."""
+
+    epoch = models.DateTimeField('точка отсчета')
+    watermark = models.DateTimeField('учтены события до')
+
+    class Meta:
+        verbose_name = 'состояние рейтинга'
+        verbose_name_plural = 'состояние рейтинга'
+
+
+class FeedEntry(models.Model):
+    """
+    Запись ленты подписок: рецепт автора, на которого подписан user.
+
+    Дата публикации и автор копируются из рецепта для сортировки ленты
+    и удаления записей при отписке.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='пользователь',)
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='рецепт',)
+
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='автор',)
+
+    pub_date = models.DateTimeField('дата публикации')
+
+    class Meta:
+        verbose_name = 'запись ленты'
+        verbose_name_plural = 'записи лент'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'recipe'],
+            name='unique_feed_entry',)]
+        indexes = [models.Index(
+            fields=['user', '-pub_date', '-recipe'],
+            name='feed_entry_timeline_idx',)]
+
+
+class DataVersionManager(models.Manager):
+    """Версии данных, общие для всех процессов."""
+
+    def current(self, keys):
+        """Версии по ключам; версия ключа без записи равна нулю."""
+
+        versions = dict.fromkeys(keys, 0)
+        versions.update(
+            self.filter(key__in=versions).values_list('key', 'version'))
+        return versions
+
+    def bump(self, keys):
+        """Увеличение версий на единицу; возвращает новые версии."""
+
+        keys = sorted(set(keys))
+        with transaction.atomic():
+            # Одновременные вызовы ждут блокировки строки и увеличивают
+            # версию по очереди, а не создают ее оба с нуля.
+            self.bulk_create(
+                [self.model(key=key, version=0) for key in keys],
+                ignore_conflicts=True)
+            self.filter(key__in=keys).update(
+                version=models.F('version') + 1)
+            return self.current(keys)
+
+    def stamp(self, keys, stamp):
+        """Версии не меньше stamp - времени изменения в наносекундах."""
+
+        keys = sorted(set(keys))
+        with transaction.atomic():
+            self.bulk_create(
+                [self.model(key=key, version=stamp) for key in keys],
+                ignore_conflicts=True)
+            self.filter(key__in=keys).update(
+                version=Greatest(models.F('version') + 1, stamp))
+
+
+class DataVersion(models.Model):
+    """Версия данных для сброса кэшей, если общий кэш не задан."""
+
+    key = models.CharField('ключ', max_length=200, primary_key=True)
+    version = models.BigIntegerField('версия', default=0)
+
+    objects = DataVersionManager()
+
+    class Meta:
+        verbose_name = 'версия данных'
+        verbose_name_plural = 'версии данных'
+
+
+class ImageVariantsTask(models.Model):
+    """
+    Фотография рецепта, для которой нужно создать уменьшенные копии.
+
+    Задача записывается в одной транзакции с рецептом и выполняется
+    командой build_image_variants, поэтому не теряется при перезапуске.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='image_variants_task',
+        verbose_name='рецепт')
+    created = models.DateTimeField('создана', auto_now_add=True)
+
+    class Meta:
+        ordering = ('created',)
+        verbose_name = 'задача обработки фотографии'
+        verbose_name_plural = 'задачи обработки фотографий'
+
+
+class RecipeIngredientChange(models.Model):
+    """
+    Изменение состава рецепта для обновления индекса поиска.
+
+    Все рецепты одной транзакции записываются с одной версией индекса,
+    поэтому процесс со старой версией дочитывает только изменившиеся
+    рецепты.
+    """
+
+    version = models.BigIntegerField('версия', db_index=True)
+    recipe_id = models.BigIntegerField('id рецепта')
+
+    class Meta:
+        verbose_name = 'изменение состава рецепта'
+        verbose_name_plural = 'изменения состава рецептов'
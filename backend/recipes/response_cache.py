@@ -0,0 +1,154 @@
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from users.models import User
+
+from .cache import CommitBatch, current_versions, stamp_versions
+from .models import (FavoriteReceipe, Ingredient, IngredientInRecipesAmount,
+                     Recipe, RecipeTag, Tag)
+
+# Допустимое расхождение часов между процессами.
+CLOCK_SKEW_NS = 10 ** 9
+
+
+class ResponseCache:
+    """
+    Кэш готовых ответов API для анонимных пользователей.
+
+    Запись хранит тело ответа и версии данных, из которых он собран:
+    рецептов ('recipe:<id>'), авторов ('user:<id>'), состава списков
+    ('list'), порядка по популярности ('popular') и справочников ('all').
+    После фиксации транзакции версией измененных данных становится время
+    изменения, и записи с прежней версией перестают действовать:
+    пересобираются только ответы, в которые входил измененный рецепт.
+    Версии общие для всех процессов, как у VersionCounter.
+    """
+
+    def __init__(self):
+        self.pending = CommitBatch(self.bump)
+
+    @property
+    def cache(self):
+        return caches[settings.REFERENCE_CACHE_ALIAS or DEFAULT_CACHE_ALIAS]
+
+    @staticmethod
+    def version_key(dependency):
+        return f'response-cache:version:{dependency}'
+
+    def versions(self, dependencies):
+        """Текущие версии зависимостей."""
+
+        keys = {self.version_key(name): name for name in dependencies}
+        versions = current_versions(
+            list(keys), initial=lambda: time.time_ns() - 2 * CLOCK_SKEW_NS)
+        return {keys[key]: version for key, version in versions.items()}
+
+    def get(self, key):
+        """Действующая запись или None."""
+
+        entry = self.cache.get(f'response-cache:entry:{key}')
+        if entry is None:
+            return None
+        versions = entry['versions']
+        if self.versions(versions) != versions:
+            return None
+        return entry
+
+    def set(self, key, content, content_type, dependencies, started):
+        """
+        Сохранение ответа; возвращает запись или None.
+
+        started - время начала сборки ответа в наносекундах. Ответ не
+        сохраняется, если его данные менялись после этого: сборка могла
+        прочитать их до изменения, а версии - уже после.
+        """
+
+        versions = self.versions(dependencies)
+        if any(version > started - CLOCK_SKEW_NS
+               for version in versions.values()):
+            return None
+        entry = {
+            'content': content,
+            'content_type': content_type,
+            'etag': f'"{md5(content).hexdigest()}"',
+            'last_modified': int(time.time()),
+            'versions': versions,
+        }
+        self.cache.set(
+            f'response-cache:entry:{key}', entry,
+            timeout=settings.RESPONSE_CACHE_TIMEOUT)
+        return entry
+
+    def bump(self, dependencies):
+        stamp_versions([self.version_key(name) for name in dependencies])
+
+    def invalidate(self, *dependencies):
+        """Сброс ответов, зависящих от данных, после фиксации транзакции."""
+
+        self.pending.add(*dependencies)
+
+
+RESPONSE_CACHE = ResponseCache()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    if created:
+        RESPONSE_CACHE.invalidate(f'recipe:{instance.pk}', 'list')
+    else:
+        RESPONSE_CACHE.invalidate(f'recipe:{instance.pk}')
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    RESPONSE_CACHE.invalidate(f'recipe:{instance.pk}', 'list')
+
+
+@receiver(post_save, sender=IngredientInRecipesAmount)
+@receiver(post_delete, sender=IngredientInRecipesAmount)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    RESPONSE_CACHE.invalidate(f'recipe:{instance.recipe_id}')
+
+
+@receiver(post_save, sender=RecipeTag)
+@receiver(post_delete, sender=RecipeTag)
+def recipe_tag_changed(sender, instance, **kwargs):
+    RESPONSE_CACHE.invalidate(f'recipe:{instance.recipe_id}', 'list')
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        RESPONSE_CACHE.invalidate(f'recipe:{instance.pk}', 'list')
+    elif pk_set:
+        RESPONSE_CACHE.invalidate(
+            *(f'recipe:{pk}' for pk in pk_set), 'list')
+    else:
+        RESPONSE_CACHE.invalidate('all')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def reference_changed(sender, **kwargs):
+    RESPONSE_CACHE.invalidate('all')
+
+
+@receiver(post_save, sender=User)
+def author_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    RESPONSE_CACHE.invalidate(f'user:{instance.pk}')
+
+
+@receiver(post_save, sender=FavoriteReceipe)
+@receiver(post_delete, sender=FavoriteReceipe)
+def favorite_changed(sender, **kwargs):
+    RESPONSE_CACHE.invalidate('popular')
@@ -0,0 +1,188 @@
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from heapq import nlargest
+from threading import Lock
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import CommitBatch, VersionCounter
+from .models import IngredientInRecipesAmount, RecipeIngredientChange
+
+
+def intersect(postings):
+    """Пересечение отсортированных списков, начиная с самого короткого."""
+
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for posting in postings[1:]:
+        matched = []
+        low = 0
+        for recipe_id in result:
+            low = bisect_left(posting, recipe_id, low)
+            if low == len(posting):
+                break
+            if posting[low] == recipe_id:
+                matched.append(recipe_id)
+        result = matched
+        if not result:
+            break
+    return list(result)
+
+
+class RecipeIngredientIndex:
+    """
+    Обратный индекс ингредиент -> отсортированный массив id рецептов.
+
+    Индекс строится из IngredientInRecipesAmount при первом обращении.
+    Изменения рецептов за транзакцию увеличивают общую версию один раз
+    и записываются в RecipeIngredientChange; процесс со старой версией
+    перечитывает из базы только рецепты из журнала, а если журнал уже
+    обрезан - строит индекс заново. Массовые вставки не отправляют
+    сигналы, поэтому при записи через API обновление вызывается явно.
+    """
+
+    # Как часто из журнала удаляются старые записи.
+    PRUNE_EVERY = 100
+
+    def __init__(self):
+        self.counter = VersionCounter('recipe-ingredient-index:version')
+        self.pending = CommitBatch(self.update_recipes)
+        self.lock = Lock()
+        self.version = None
+        self.postings = {}
+        # Число ингредиентов рецепта по его id.
+        self.counts = array('H')
+
+    def grow(self, recipe_id):
+        """Место в counts для рецепта recipe_id."""
+
+        if recipe_id >= len(self.counts):
+            size = max(recipe_id + 1, 2 * len(self.counts))
+            self.counts.frombytes(
+                bytes(self.counts.itemsize * (size - len(self.counts))))
+
+    def build(self):
+        postings = {}
+        self.counts = array('H')
+        rows = IngredientInRecipesAmount.objects.order_by(
+            'ingredient_id', 'recipe_id',
+        ).values_list('ingredient_id', 'recipe_id')
+        for ingredient_id, recipe_id in rows.iterator():
+            posting = postings.get(ingredient_id)
+            if posting is None:
+                posting = postings[ingredient_id] = array('q')
+            posting.append(recipe_id)
+            self.grow(recipe_id)
+            self.counts[recipe_id] += 1
+        self.postings = postings
+
+    def remove(self, recipe_id):
+        """Удаление рецепта из всех списков, где он есть."""
+
+        remaining = self.counts[recipe_id]
+        for posting in self.postings.values():
+            if not remaining:
+                break
+            position = bisect_left(posting, recipe_id)
+            if position < len(posting) and posting[position] == recipe_id:
+                del posting[position]
+                remaining -= 1
+        self.counts[recipe_id] = 0
+
+    def apply_changes(self, recipe_ids):
+        """Замена ингредиентов рецептов на текущие из базы."""
+
+        for recipe_id in recipe_ids:
+            self.grow(recipe_id)
+            self.remove(recipe_id)
+        rows = IngredientInRecipesAmount.objects.filter(
+            recipe_id__in=recipe_ids,
+        ).values_list('ingredient_id', 'recipe_id')
+        for ingredient_id, recipe_id in rows:
+            insort(self.postings.setdefault(
+                ingredient_id, array('q')), recipe_id)
+            self.counts[recipe_id] += 1
+
+    def load(self):
+        version = self.counter.current()
+        with self.lock:
+            if self.version == version:
+                return
+            changed = version - (self.version or 0)
+            if (self.version is not None and 0 < changed
+                    <= settings.RECIPE_SEARCH_CHANGELOG_LENGTH):
+                changes = RecipeIngredientChange.objects.filter(
+                    version__gt=self.version, version__lte=version,
+                ).values_list('version', 'recipe_id')
+                versions, recipe_ids = set(), set()
+                for change_version, recipe_id in changes:
+                    versions.add(change_version)
+                    recipe_ids.add(recipe_id)
+                if len(versions) == changed:
+                    self.apply_changes(recipe_ids)
+                    self.version = version
+                    return
+            self.build()
+            self.version = version
+
+    def search(self, ingredient_ids, require_all=False, limit=100):
+        """
+        Рецепты с наибольшим числом ингредиентов из ingredient_ids.
+
+        При равном числе совпадений выше рецепты, в которых меньше
+        недостающих ингредиентов, затем более новые.
+        """
+
+        self.load()
+        with self.lock:
+            postings = [
+                self.postings.get(ingredient_id, ())
+                for ingredient_id in set(ingredient_ids)]
+            if not postings:
+                return []
+            if require_all:
+                matched = Counter(dict.fromkeys(
+                    intersect(postings), len(postings)))
+            else:
+                matched = Counter()
+                for posting in postings:
+                    matched.update(posting)
+            counts = self.counts
+            return nlargest(
+                limit, matched,
+                key=lambda recipe_id: (
+                    matched[recipe_id],
+                    matched[recipe_id] - counts[recipe_id],
+                    recipe_id))
+
+    def update_recipes(self, recipe_ids):
+        """Запись изменений рецептов в журнал с одной новой версией."""
+
+        with transaction.atomic():
+            version = self.counter.bump()
+            RecipeIngredientChange.objects.bulk_create([
+                RecipeIngredientChange(version=version, recipe_id=recipe_id)
+                for recipe_id in sorted(recipe_ids)])
+            if version % self.PRUNE_EVERY == 0:
+                RecipeIngredientChange.objects.filter(
+                    version__lte=(
+                        version - settings.RECIPE_SEARCH_CHANGELOG_LENGTH),
+                ).delete()
+
+    def schedule_update(self, recipe_id):
+        """Обновление рецепта после фиксации транзакции, одно на все."""
+
+        self.pending.add(recipe_id)
+
+
+RECIPE_INGREDIENT_INDEX = RecipeIngredientIndex()
+
+
+@receiver(post_save, sender=IngredientInRecipesAmount)
+@receiver(post_delete, sender=IngredientInRecipesAmount)
+def ingredient_amount_changed(sender, instance, **kwargs):
+    RECIPE_INGREDIENT_INDEX.schedule_update(instance.recipe_id)
@@ -0,0 +1,90 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.utils import timezone
+
+from .models import FavoriteReceipe, RecipeTrend, ShoppingCart, TrendingState
+
+EVENT_WEIGHTS = (
+    (FavoriteReceipe, 1.0),
+    (ShoppingCart, 0.5),
+)
+# События старше стольких периодов полураспада почти не влияют на рейтинг.
+BACKFILL_HALF_LIVES = 10
+# Точка отсчета сдвигается раньше, чем множители выйдут за пределы float.
+REBASE_HALF_LIVES = 64
+UPDATE_BATCH_SIZE = 500
+
+
+def half_life():
+    return timedelta(hours=settings.TRENDING_HALF_LIFE_HOURS)
+
+
+def growth(moment, epoch):
+    """Множитель события в момент moment относительно точки отсчета."""
+
+    return 2 ** ((moment - epoch) / half_life())
+
+
+def add_scores(increments):
+    """Прибавление вкладов к рейтингам рецептов."""
+
+    existing = set(RecipeTrend.objects.filter(
+        recipe_id__in=increments).values_list('recipe_id', flat=True))
+    existing = sorted(existing)
+    for start in range(0, len(existing), UPDATE_BATCH_SIZE):
+        batch = existing[start:start + UPDATE_BATCH_SIZE]
+        RecipeTrend.objects.filter(recipe_id__in=batch).update(
+            score=F('score') + Case(
+                *[When(recipe_id=recipe_id,
+                       then=Value(increments[recipe_id]))
+                  for recipe_id in batch],
+                output_field=FloatField()))
+    RecipeTrend.objects.bulk_create(
+        [RecipeTrend(recipe_id=recipe_id, score=score)
+         for recipe_id, score in increments.items()
+         if recipe_id not in existing],
+        batch_size=UPDATE_BATCH_SIZE)
+
+
+def refresh_trending(now=None):
+    """
+    Учет в рейтинге событий, добавленных после прошлого обновления.
+
+    События последних TRENDING_LAG_SECONDS секунд откладываются до
+    следующего запуска, чтобы не пропустить еще не зафиксированные
+    транзакции. Возвращает число учтенных событий.
+    """
+
+    now = now or timezone.now()
+    upto = now - timedelta(seconds=settings.TRENDING_LAG_SECONDS)
+    with transaction.atomic():
+        state, _ = TrendingState.objects.select_for_update().get_or_create(
+            pk=1, defaults={
+                'epoch': upto,
+                'watermark': upto - half_life() * BACKFILL_HALF_LIVES})
+        if upto <= state.watermark:
+            return 0
+        if upto - state.epoch > half_life() * REBASE_HALF_LIVES:
+            RecipeTrend.objects.update(
+                score=F('score') / growth(upto, state.epoch))
+            state.epoch = upto
+        increments = defaultdict(float)
+        events = 0
+        for model, weight in EVENT_WEIGHTS:
+            rows = model.objects.filter(
+                created__gt=state.watermark, created__lte=upto,
+            ).values_list('recipe_id', 'created')
+            for recipe_id, created in rows.iterator():
+                increments[recipe_id] += weight * growth(created, state.epoch)
+                events += 1
+        add_scores(increments)
+        RecipeTrend.objects.filter(
+            score__lt=settings.TRENDING_MIN_SCORE * growth(upto, state.epoch),
+        ).delete()
+        state.watermark = upto
+        state.save()
+    return events
@@ -1,7 +1,40 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
 
 
+class CounterQuerySet(models.QuerySet):
+    """Набор запросов с атомарным изменением счетчиков."""
+
+    def change_counter(self, field, delta):
+        """
+        Изменение счетчика field на delta через F().
+
+        Счетчик не уменьшается ниже нуля.
+        """
+
+        queryset = self
+        if delta < 0:
+            queryset = queryset.filter(**{f'{field}__gte': -delta})
+        return queryset.update(**{field: models.F(field) + delta})
+
+
+class UserQuerySet(CounterQuerySet):
+    """Набор запросов для пользователей."""
+
+    def add_subscribed(self, user):
+        """Флаг подписки пользователя user на каждого из авторов."""
+
+        if not user.is_authenticated:
+            return self.annotate(is_subscribed=models.Value(
+                False, output_field=models.BooleanField()))
+        return self.annotate(is_subscribed=models.Exists(
+            Follow.objects.filter(user=user, author=models.OuterRef('pk'))))
+
+
+class FoodgramUserManager(UserManager.from_queryset(UserQuerySet)):
+    """Менеджер пользователей с дополнительными выборками."""
+
+
 class User(AbstractUser):
     """Модель пользователя."""
 
@@ -29,6 +62,16 @@ class User(AbstractUser):
         blank=False,
         null=False
     )
+    recipes_count = models.PositiveIntegerField(
+        "Число рецептов",
+        default=0,
+        editable=False)
+    followers_count = models.PositiveIntegerField(
+        "Число подписчиков",
+        default=0,
+        editable=False)
+
+    objects = FoodgramUserManager()
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ("username", "first_name", "last_name",)